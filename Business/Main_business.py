@@ -1,27 +1,17 @@
-import time
 from Business.events import (
-    ARPU,
-    ARPPU,
-    payment_ratio, LTV, AOV, cancel_sub, payment_rate_all, payment_rate_new, subscribe_new, AOV_new
+    ARPU, revenue_metrics, cuped_metrics,
+    payment_ratio, LTV, cancel_sub, payment_rate_all, payment_rate_new, subscribe_new, AOV_new
 )
+from pipeline.scheduler import job, run_dag
 
-def run_event(event_name, event_func, tag, explanation):
-    print(f"\n🚀 开始执行 {event_name} 计算，标签：{tag}")
-    print(f"【说明】{explanation}")
-    start_time = time.time()
-    try:
-        event_func(tag)
-        print(f"✅ {event_name} 计算完成，耗时：{round(time.time() - start_time, 2)}秒")
-    except Exception as e:
-        print(f"❌ {event_name} 计算失败，错误信息：{e}")
-
-def main(tag):
-    print(f"\n🎬 【主流程启动】标签：{tag}\n")
 
+def build_jobs():
     events = [
-        ("AOV", AOV.main, "7日生命周期价值（LTV）计算，衡量用户在加入后的前7天内所产生的总价值。"),
+        # ARPPU / AOV 由指标注册表编译为一条语句（每个收入源只扫描一次），并写回原报表
+        ("revenue_metrics", revenue_metrics.main, "ARPU、ARPPU、AOV 等收入指标合并计算，共享订阅 / 内购 / 广告收入扫描。"),
+        # 原 ARPU 报表按当天曝光归组，与注册表的首次分流口径不同，保持原任务
         ("ARPU", ARPU.main, "每用户平均收入（ARPU）计算，反映每个用户带来的平均收入。"),
-        ("ARPPU", ARPPU.main, "每付费用户平均收入（ARPPU）计算，反映每个付费用户产生的收入。"),
+        ("cuped_metrics", cuped_metrics.main, "CUPED：以实验前同一指标为协变量，在服务端计算方差缩减后的均值与置信区间。"),
         ("cancel_sub", cancel_sub.main, "7日生命周期价值（LTV）计算，衡量用户在加入后的前7天内所产生的总价值。"),
         ("LTV", LTV.main, "7日生命周期价值（LTV）计算，衡量用户在加入后的前7天内所产生的总价值。"),
         ("payment_rate_all", payment_rate_all.main, "7日生命周期价值（LTV）计算，衡量用户在加入后的前7天内所产生的总价值。"),
@@ -31,9 +21,13 @@ def main(tag):
         ("payment", payment_ratio.main, "支付比例计算完成")
     ]
 
-    for event_name, event_func, explanation in events:
-        run_event(event_name, event_func, tag, explanation)
+    # 各商业化指标都是独立的 INSERT…SELECT，彼此无依赖，可并发执行
+    return [job(event_name, event_func, explanation=explanation) for event_name, event_func, explanation in events]
 
+
+def main(tag, max_concurrency=None):
+    print(f"\n🎬 【主流程启动】标签：{tag}\n")
+    run_dag(build_jobs(), tag, max_concurrency=max_concurrency)
     print("\n🎉 【所有计算处理完毕】")
 
 if __name__ == "__main__":
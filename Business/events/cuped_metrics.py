@@ -0,0 +1,54 @@
+import sys
+from datetime import timedelta
+
+from dotenv import load_dotenv
+
+from Business.events.revenue_metrics import PAID, REVENUE
+from growthbook_fetcher.experiment_tag_all_parameters import get_experiment_details_by_tag
+from pipeline.assignment import get_assignment_table
+from pipeline.cuped import CUPED_PRE_DAYS, run_cuped
+from pipeline.metric_registry import metric
+
+load_dotenv()
+
+# ============= CUPED 指标声明 =============
+# 长尾的收入 / 互动指标：协变量为同一指标的实验前取值；分母为 users 时只统计分母内的用户
+CUPED_METRICS = [
+    metric("arpu", REVENUE, "sum", ("users", "session")),
+    metric("arppu", REVENUE, "sum", ("users", PAID)),
+    metric("revenue_per_assigned_user", REVENUE, "sum"),
+    metric("time_spent_minutes", "session", "sum", ("users", "session")),
+    metric("messages_per_user", "chat_send", "count", ("users", "session")),
+]
+
+
+def main(tag):
+    print(f"🚀 开始计算 CUPED 调整指标，标签：{tag}")
+    experiment_data = get_experiment_details_by_tag(tag)
+    if not experiment_data:
+        print(f"⚠️ 没有找到符合标签 '{tag}' 的实验数据！")
+        return
+
+    experiment_name = experiment_data['experiment_name']
+    start_date = experiment_data['phase_start_time'].date()
+    end_date = experiment_data['phase_end_time'].date()
+    if (end_date - start_date).days < 2:
+        print("⚠️ 实验周期过短，无法剔除首尾两天。")
+        return
+
+    # 与商业化指标口径一致：剔除首尾两天；实验前窗口以实验开始日为界
+    first_day, last_day = start_date + timedelta(days=1), end_date - timedelta(days=1)
+    print(f"📝 实验名称：{experiment_name}，有效实验时间：{first_day} 至 {last_day}，实验前 {CUPED_PRE_DAYS} 天为协变量窗口")
+
+    assignment_table = get_assignment_table(tag, experiment_name)
+    table_name = run_cuped(CUPED_METRICS, tag, assignment_table, first_day, last_day, start_date)
+    print(f"🎉 CUPED 结果已写入 {table_name}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        tag = sys.argv[1]
+    else:
+        tag = "mobile_new"
+        print(f"⚠️ 未指定实验标签，默认使用：{tag}")
+    main(tag)
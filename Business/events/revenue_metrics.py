@@ -0,0 +1,134 @@
+import sys
+from datetime import timedelta
+
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+from growthbook_fetcher.experiment_tag_all_parameters import get_experiment_details_by_tag
+from pipeline.assignment import get_assignment_table
+from pipeline.compaction import compact_to_summary
+from pipeline.db_engine import get_db_connection
+from pipeline.estimate import APPROX_FLAG_COLUMN, ensure_approx_column
+from pipeline.metric_registry import metric, run_metrics, pivot_query
+
+load_dotenv()
+
+# ============= 商业化指标声明 =============
+PAID = ["subscribe", "currency_purchase"]
+REVENUE = PAID + ["ads_impression"]
+
+REVENUE_METRICS = [
+    metric("active_users", "session", "users"),
+    metric("subscribe_revenue", "subscribe", "sum"),
+    metric("order_revenue", "currency_purchase", "sum"),
+    metric("ad_revenue", "ads_impression", "sum"),
+    metric("paid_revenue", PAID, "sum"),
+    metric("total_revenue", REVENUE, "sum"),
+    metric("paying_users", PAID, "users"),
+    metric("order_cnt", PAID, "count"),
+    metric("arpu", REVENUE, "sum", ("users", "session")),
+    metric("arppu", REVENUE, "sum", ("users", PAID)),
+    metric("aov", PAID, "sum", "count", precision=2),
+]
+
+# 原单指标报表：表名模板 → (建表语句, [(输出列, 指标名, 字段)])
+# tbl_report_arpu_{tag} 按当天曝光归组（ARPU.py），与这里的首次分流口径不同，仍由 ARPU 任务单独写入；
+# 首次分流口径的 ARPU 只出现在指标长表 tbl_report_business_metrics_{tag} 中
+# 口径变化（看板数字会与原 ARPPU.py / AOV.py 不同）：
+# - 日期范围统一为剔除首尾两天；原 AOV.py 从第二天算到 phase_end 当天，现在最后一天不再出现
+# - 事件只在 event_date >= 首次分流日时计入分组，分流前产生的收入 / 订单不再归到分组里
+LEGACY_REPORTS = {
+    "tbl_report_arppu_daily_{tag}": ("""
+    CREATE TABLE IF NOT EXISTS {table} (
+        event_date DATE,
+        variation_id VARCHAR(255),
+        total_subscribe_revenue DOUBLE,
+        total_order_revenue DOUBLE,
+        total_revenue DOUBLE,
+        paying_users INT,
+        active_users INT,
+        arppu DOUBLE,
+        experiment_tag VARCHAR(255)
+    );
+    """, [
+        ("total_subscribe_revenue", "subscribe_revenue", "numerator"),
+        ("total_order_revenue", "order_revenue", "numerator"),
+        ("total_revenue", "arppu", "numerator"),
+        ("paying_users", "paying_users", "numerator"),
+        ("active_users", "paying_users", "numerator"),
+        ("arppu", "arppu", "value"),
+    ]),
+    "tbl_report_AOV_{tag}": ("""
+    CREATE TABLE IF NOT EXISTS {table} (
+        event_date DATE DEFAULT NULL,
+        variation_id VARCHAR(64) DEFAULT NULL,
+        total_revenue DOUBLE,
+        total_order_cnt INT,
+        aov DOUBLE
+    );
+    """, [
+        ("total_revenue", "paid_revenue", "numerator"),
+        ("total_order_cnt", "order_cnt", "numerator"),
+        ("aov", "aov", "value"),
+    ]),
+}
+
+
+def publish_legacy_reports(tag, table_name):
+    """
+    从指标长表派生 ARPPU / AOV 原报表（服务端 INSERT OVERWRITE），看板无需改动。
+    原报表补充 is_approximate 列，估算模式的结果在看板上可区分。
+    """
+    engine = get_db_connection()
+    for template, (create_table_query, columns) in LEGACY_REPORTS.items():
+        legacy_table = template.format(tag=tag)
+        with engine.connect() as conn:
+            conn.execute(text(create_table_query.format(table=legacy_table)))
+            ensure_approx_column(conn, legacy_table)
+
+        with_tag = "experiment_tag" in create_table_query
+        out_columns = ["event_date", "variation_id"] + [out for out, _, _ in columns]
+        if with_tag:
+            out_columns.append("experiment_tag")
+        out_columns.append(APPROX_FLAG_COLUMN)
+        select_sql = pivot_query(table_name, columns, with_tag=with_tag, with_flag=True)
+        compact_to_summary(legacy_table, out_columns, select_sql)
+
+
+def main(tag, chunk_days=None):
+    print(f"🚀 开始计算商业化指标（指标注册表编译），标签：{tag}")
+    experiment_data = get_experiment_details_by_tag(tag)
+    if not experiment_data:
+        print(f"⚠️ 没有找到符合标签 '{tag}' 的实验数据！")
+        return
+
+    experiment_name = experiment_data['experiment_name']
+    start_date = experiment_data['phase_start_time'].date()
+    end_date = experiment_data['phase_end_time'].date()
+    if (end_date - start_date).days < 2:
+        print("⚠️ 实验周期过短，无法剔除首尾两天。")
+        return
+
+    # 剔除首尾两天
+    first_day, last_day = start_date + timedelta(days=1), end_date - timedelta(days=1)
+    print(f"📝 实验名称：{experiment_name}，有效实验时间：{first_day} 至 {last_day}")
+
+    assignment_table = get_assignment_table(tag, experiment_name)
+    table_name = f"tbl_report_business_metrics_{tag}"
+    run_metrics(REVENUE_METRICS, table_name, assignment_table, first_day, last_day, tag, chunk_days)
+    publish_legacy_reports(tag, table_name)
+
+    result_df = pd.read_sql(f"SELECT * FROM {table_name} ORDER BY event_date, metric, variation_id;",
+                            get_db_connection())
+    print("🚀 商业化指标预览：")
+    print(result_df)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        tag = sys.argv[1]
+    else:
+        tag = "mobile_new"
+        print(f"⚠️ 未指定实验标签，默认使用：{tag}")
+    main(tag)
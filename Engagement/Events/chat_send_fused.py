@@ -0,0 +1,285 @@
+import sys
+import pandas as pd
+from sqlalchemy import text
+from pipeline.db_engine import get_db_connection
+from datetime import datetime, timedelta
+from growthbook_fetcher.experiment_tag_all_parameters import get_experiment_details_by_tag
+from pipeline.assignment import get_assignment_table
+from pipeline.checkpoint import begin_job, run_unit
+from pipeline.compaction import compact_to_summary
+from pipeline.watermark import plan_refresh, clear_refresh_range, set_watermark
+from pipeline.date_range import dates_union_sql, delete_date_range_sql, iter_date_chunks
+from pipeline.sufficient_stats import STATS_COLUMNS, prepare_stats, stats_table_name, stats_union_sql
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# ============= chat_send 融合指标定义 =============
+# 指标名 → tbl_app_event_chat_send.Method；同一次扫描里用条件聚合分别计数
+CHAT_SEND_METHODS = {
+    "continue": "continue",
+    "regen": "regenerate",
+    "edit": "edit",
+}
+# new_conversation 不按 Method 过滤：会话数 / 发送用户数
+NEW_CONVERSATION = "new_conversation"
+
+# 兼容原单指标报表：指标名 → (表名模板, event_date 类型)
+LEGACY_TABLES = {
+    "continue": ("tbl_report_continue_{tag}", "VARCHAR(255)"),
+    "regen": ("tbl_report_regen_{tag}", "VARCHAR(255)"),
+    "edit": ("tbl_report_edit_daily_{tag}", "DATE"),
+    NEW_CONVERSATION: ("tbl_report_new_conversation_{tag}", "VARCHAR(255)"),
+}
+
+
+CHAT_SEND_METRICS = list(CHAT_SEND_METHODS) + [NEW_CONVERSATION]
+# 原 Regen.py 逐日逐分组写入，没有事件的 (日期, 分组) 也有一行 0；这些指标按 日期 × 分组 补齐
+ZERO_FILL_METRICS = ("regen",)
+
+
+def build_stats_insert_query(stats_table, experiment_tag, experiment_name, assignment_table, chunk_start, chunk_end):
+    """
+    一次扫描 chat_send，按 (event_date, variation, 用户) 算出每个 Method 的事件数（new_conversation 为会话数），
+    写入充分统计量：n = 有该行为的用户数，Σx / Σx² = 用户事件数的和 / 平方和。
+    分组口径与原单指标模块一致：
+    - continue / edit / new_conversation：当天曝光（小时级分流表按 (user_id, event_date) 去重），a.event_date = b.event_date；
+      continue / edit 取当天最早的一次分流，new_conversation 沿用原来的 DISTINCT (user_id, variation_id)
+    - regen：首次分流表，只按 user_id 关联
+    """
+    exposure_columns = [
+        f"COUNT(DISTINCT CASE WHEN b.rn = 1 AND a.Method = '{method}' THEN a.event_id END) AS x_{metric}"
+        for metric, method in CHAT_SEND_METHODS.items() if metric != "regen"
+    ]
+    exposure_columns += ["0 AS x_regen",
+                         f"COUNT(DISTINCT a.conversation_id) AS x_{NEW_CONVERSATION}",
+                         "1 AS is_exposure"]
+    assignment_columns = [f"0 AS x_{metric}" for metric in CHAT_SEND_METHODS if metric != "regen"]
+    assignment_columns += ["COUNT(DISTINCT a.event_id) AS x_regen",
+                           f"0 AS x_{NEW_CONVERSATION}",
+                           "0 AS is_exposure"]
+    exposure_sql = ",\n            ".join(exposure_columns)
+    assignment_sql = ",\n            ".join(assignment_columns)
+    # 各 Method 的 n 只计有该行为的用户；new_conversation 的 n 为当天曝光且发送过消息的全部用户
+    stats_metrics = [(metric, f"x_{metric}", None, f"x_{metric} > 0") for metric in CHAT_SEND_METHODS]
+    stats_metrics.append((NEW_CONVERSATION, f"x_{NEW_CONVERSATION}", None, "is_exposure = 1"))
+
+    return f"""
+    INSERT INTO {stats_table} ({", ".join(STATS_COLUMNS)})
+    WITH events AS (
+        SELECT event_date, user_id, event_id, conversation_id, Method
+        FROM flow_event_info.tbl_app_event_chat_send
+        WHERE event_date BETWEEN '{chunk_start}' AND '{chunk_end}'
+    ),
+    exposure AS (
+        -- rn = 1 为当天最早的一次分流；同一用户当天命中多个分组时每个分组各保留一行
+        SELECT user_id, variation_id, event_date, MIN(rn) AS rn
+        FROM (
+            SELECT
+                user_id,
+                variation_id,
+                event_date,
+                ROW_NUMBER() OVER (PARTITION BY user_id, event_date ORDER BY timestamp_assigned ASC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = '{experiment_name}'
+              AND event_date BETWEEN '{chunk_start}' AND '{chunk_end}'
+        ) t
+        GROUP BY user_id, variation_id, event_date
+    ),
+    units AS (
+        SELECT
+            a.event_date,
+            b.variation_id,
+            a.user_id,
+            {exposure_sql}
+        FROM events a
+        JOIN exposure b
+          ON a.user_id = b.user_id
+         AND a.event_date = b.event_date
+        GROUP BY a.event_date, b.variation_id, a.user_id
+        UNION ALL
+        SELECT
+            a.event_date,
+            b.variation AS variation_id,
+            a.user_id,
+            {assignment_sql}
+        FROM events a
+        JOIN {assignment_table} b
+          ON a.user_id = b.user_id
+        WHERE a.Method = '{CHAT_SEND_METHODS['regen']}'
+        GROUP BY a.event_date, b.variation, a.user_id
+    )
+    {stats_union_sql(stats_metrics, experiment_tag)};
+    """
+
+
+def build_fused_insert_query(table_name, experiment_name, stats_table, assignment_table, chunk_start, chunk_end):
+    """
+    由充分统计量派生长表 (metric, total_events, unique_users, ratio)：Σx、n、Σx / n，不再扫描 chat_send。
+    ZERO_FILL_METRICS 用 日期 × 分组 补齐，没有事件的组合写 0。
+    """
+    metrics = ", ".join(f"'{metric}'" for metric in CHAT_SEND_METRICS)
+    zero_fill = " UNION ALL ".join(f"SELECT '{metric}' AS metric" for metric in ZERO_FILL_METRICS)
+    return f"""
+    INSERT INTO {table_name} (event_date, variation, metric, total_events, unique_users, ratio, experiment_name)
+    WITH s AS (
+        SELECT event_date, variation_id, metric, sum_x, n
+        FROM {stats_table}
+        WHERE metric IN ({metrics}) AND grain = 'daily'
+          AND event_date BETWEEN '{chunk_start}' AND '{chunk_end}'
+          AND n > 0
+    ),
+    grid AS (
+        SELECT CAST(d.event_date AS DATE) AS event_date, v.variation_id, m.metric
+        FROM (
+            {dates_union_sql(chunk_start, chunk_end)}
+        ) d
+        CROSS JOIN (SELECT DISTINCT variation AS variation_id FROM {assignment_table}) v
+        CROSS JOIN ({zero_fill}) m
+    ),
+    filled AS (
+        SELECT event_date, variation_id, metric, sum_x, n FROM s
+        UNION ALL
+        SELECT g.event_date, g.variation_id, g.metric, 0 AS sum_x, 0 AS n
+        FROM grid g
+        LEFT JOIN s
+          ON g.event_date = s.event_date AND g.variation_id = s.variation_id AND g.metric = s.metric
+        WHERE s.metric IS NULL
+    )
+    SELECT event_date, variation_id, metric, sum_x, n,
+           CASE WHEN n = 0 THEN 0 ELSE ROUND(sum_x * 1.0 / n, 4) END,
+           '{experiment_name}'
+    FROM filled;
+    """
+
+
+def publish_legacy_tables(tag, table_name):
+    """从长表派生原来的单指标报表（服务端 INSERT OVERWRITE），看板无需改动。"""
+    with get_db_connection().connect() as conn:
+        for metric, (legacy_template, date_type) in LEGACY_TABLES.items():
+            conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {legacy_template.format(tag=tag)} (
+                event_date {date_type},
+                variation VARCHAR(255),
+                total_{metric} INT,
+                unique_{metric}_users INT,
+                {metric}_ratio DOUBLE,
+                experiment_name VARCHAR(255)
+            );
+            """))
+
+    for metric, (legacy_template, _) in LEGACY_TABLES.items():
+        compact_to_summary(
+            legacy_template.format(tag=tag),
+            ["event_date", "variation", f"total_{metric}", f"unique_{metric}_users", f"{metric}_ratio", "experiment_name"],
+            f"""
+            SELECT event_date, variation, total_events, unique_users, ratio, experiment_name
+            FROM {table_name}
+            WHERE metric = '{metric}'
+            """,
+        )
+
+
+def main(tag, chunk_days=None):
+    print(f"🚀 开始获取实验 chat_send 融合指标，标签：{tag}")
+
+    experiment_data = get_experiment_details_by_tag(tag)
+    if not experiment_data:
+        print(f"⚠️ 没有找到符合标签 '{tag}' 的实验数据！")
+        return
+
+    experiment_name = experiment_data['experiment_name']
+    start_time = experiment_data['phase_start_time']
+    end_time = experiment_data['phase_end_time']
+
+    start_date = datetime.strptime(start_time.strftime("%Y-%m-%d"), "%Y-%m-%d")
+    end_date = datetime.strptime(end_time.strftime("%Y-%m-%d"), "%Y-%m-%d")
+
+    print(f"📝 实验名称：{experiment_name}")
+    print(f"⏰ 实验时间范围：{start_date.date()} ~ {end_date.date()}（排除首尾日）")
+
+    assignment_table = get_assignment_table(tag, experiment_name)
+    engine = get_db_connection()
+    table_name = f"tbl_report_chat_send_metrics_{tag}"
+
+    drop_table_query = f"DROP TABLE IF EXISTS {table_name};"
+    create_table_query = f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        event_date DATE COMMENT '日期',
+        variation VARCHAR(255) COMMENT '实验分组',
+        metric VARCHAR(64) COMMENT '指标：continue / regen / edit / new_conversation',
+        total_events BIGINT COMMENT '事件数（new_conversation 为会话数）',
+        unique_users BIGINT COMMENT '去重用户数',
+        ratio DOUBLE COMMENT '人均次数',
+        experiment_name VARCHAR(255) COMMENT '实验名称'
+    );
+    """
+
+    # 增量：按水位只重算新日期和末尾可能有迟到数据的日期；全量时重建整表
+    last_day = end_date - timedelta(days=1)
+    refresh_start, incremental = plan_refresh(tag, table_name, experiment_name,
+                                              start_date + timedelta(days=1), last_day)
+    # 断点续跑：--resume 且上次有失败的日期块时保留已写入的数据，只补跑失败 / 缺失的日期块
+    job_name = f"chat_send_fused_{tag}"
+    resuming = begin_job(tag, job_name)
+    failed_chunks = []
+
+    with engine.connect() as conn:
+        conn.execute(text("SET query_timeout = 30000;"))
+        if not incremental and not resuming:
+            conn.execute(text(drop_table_query))
+        conn.execute(text(create_table_query))
+        if resuming:
+            stats_table = stats_table_name(tag)
+        else:
+            clear_refresh_range(conn, table_name, "event_date", refresh_start, incremental)
+            stats_table = prepare_stats(conn, tag, CHAT_SEND_METRICS, refresh_start if incremental else None)
+        print(f"✅ 表 {table_name} 已就绪，从 {refresh_start} 开始写入。")
+
+        def execute_all(queries):
+            for query in queries:
+                conn.execute(text(query))
+
+        metric_names = ", ".join(f"'{metric}'" for metric in CHAT_SEND_METRICS)
+        # 每个日期块只扫描一次 chat_send：先写充分统计量，所有 Method 的长表行再由统计量派生
+        for chunk_start, chunk_end in iter_date_chunks(refresh_start, last_day, chunk_days):
+            print(f"👉 正在插入日期：{chunk_start} ~ {chunk_end}")
+            queries = (build_stats_insert_query(stats_table, tag, experiment_name, assignment_table,
+                                                chunk_start, chunk_end),
+                       build_fused_insert_query(table_name, experiment_name, stats_table, assignment_table,
+                                                chunk_start, chunk_end))
+            # 续跑时先删除该日期块的统计量和长表行，重试不会重复计数
+            cleanups = (
+                delete_date_range_sql(stats_table, "event_date", chunk_start, chunk_end,
+                                      [f"metric IN ({metric_names})", "grain = 'daily'"]),
+                delete_date_range_sql(table_name, "event_date", chunk_start, chunk_end),
+            )
+            ok = run_unit(
+                tag, job_name, chunk_start, chunk_end,
+                lambda qs=queries: execute_all(qs),
+                cleanup=(lambda qs=cleanups: execute_all(qs)) if resuming else None,
+            )
+            if not ok:
+                print(f"🔍 SQL:\n{queries[0]}")
+                failed_chunks.append((chunk_start, chunk_end))
+
+    if failed_chunks:
+        # 长表不完整时不覆盖单指标报表，也不推进水位
+        raise RuntimeError(f"{len(failed_chunks)} 个日期块写入失败，保留单指标报表上一版数据，"
+                           f"可使用 --resume 补跑：{failed_chunks}")
+
+    publish_legacy_tables(tag, table_name)
+    set_watermark(tag, table_name, experiment_name, last_day)
+
+    result_df = pd.read_sql(f"SELECT * FROM {table_name} ORDER BY event_date, metric, variation;", engine)
+    print("🚀 chat_send 融合指标预览：")
+    print(result_df)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        tag = sys.argv[1]
+    else:
+        tag = "mobile_new"
+        print(f"⚠️ 未指定实验标签，默认使用：{tag}")
+    main(tag)
@@ -1,38 +1,26 @@
-import time
 from Engagement.Events import (
-    Continue,
     Follow,
-    New_Conversation,
-    Regen,
-    Conversation_reset, edit
+    Conversation_reset,
+    chat_send_fused
 )
+from pipeline.scheduler import job, run_dag
 
 
-def run_event(event_name, event_func, tag):
-    print(f"\n🚀 开始执行 {event_name} 事件，标签：{tag}")
-    start_time = time.time()
-    try:
-        event_func(tag)
-        print(f"✅ {event_name} 事件执行完成，耗时：{round(time.time() - start_time, 2)}秒")
-    except Exception as e:
-        print(f"❌ {event_name} 事件执行失败，错误信息：{e}")
-
-
-def main(tag):
-    print(f"\n🎬 【主流程启动】标签：{tag}\n")
-
+def build_jobs():
     events = [
-        ("Continue", Continue.main),
+        # Continue / edit / Regen / New_Conversation 合并为一次 chat_send 扫描，同时写回原单指标报表
+        ("chat_send_fused", chat_send_fused.main),
         ("Conversation_reset", Conversation_reset.main),
-        ("edit", edit.main),
-        ("Follow", Follow.main),
-        ("New_Conversation", New_Conversation.main),
-        ("Regen", Regen.main)
+        ("Follow", Follow.main)
     ]
 
-    for event_name, event_func in events:
-        run_event(event_name, event_func, tag)
+    # 各互动指标互相独立，可并发执行
+    return [job(event_name, event_func) for event_name, event_func in events]
+
 
+def main(tag, max_concurrency=None):
+    print(f"\n🎬 【主流程启动】标签：{tag}\n")
+    run_dag(build_jobs(), tag, max_concurrency=max_concurrency)
     print("\n🎉 【所有事件处理完毕】")
 
 
@@ -1,13 +1,28 @@
-import time  # 如果后续不使用，可以移除
-
 from Retention import retention_report_table_ETL, active_retention_wide_table_ETL, \
     retention_report_table_active_ETL, First_Retention_overall, Active_Retention_overall, test_country, generate_rate
 from Retention.active_retention_wide_table_ETL import insert_experiment_data_to_wide_active_table
 from Retention.retention_wide_table_ETL import insert_experiment_data_to_wide_table
 from growthbook_fetcher.experiment_tag_all_parameters import get_experiment_details_by_tag
+from pipeline.scheduler import job, run_dag
+
+
+def build_jobs():
+    # 宽表 → 报告表 → 整体表；新用户留存与活跃留存两条链路互不依赖，可并发执行
+    return [
+        job("retention_wide", insert_experiment_data_to_wide_table),
+        job("retention_report", retention_report_table_ETL.main, deps=["retention_wide"]),
+        job("First_Retention_overall", First_Retention_overall.main, deps=["retention_wide"]),
+
+        job("retention_active_wide", insert_experiment_data_to_wide_active_table),
+        job("retention_active_report", retention_report_table_active_ETL.main, deps=["retention_active_wide"]),
+        job("Active_Retention_overall", Active_Retention_overall.main, deps=["retention_active_wide"]),
 
+        # job("generate_rate", generate_rate.main),
+        # job("test_country", test_country.main),
+    ]
 
-def run_experiment_data_etl(tag):
+
+def run_experiment_data_etl(tag, max_concurrency=None):
     # 根据标签获取实验详细信息，并存储返回结果（如果需要）
     experiment_data = get_experiment_details_by_tag(tag)
     if experiment_data:
@@ -15,21 +30,11 @@ def run_experiment_data_etl(tag):
     else:
         print("未获取到实验详细信息。")
 
-    # 将实验数据插入宽表
-    insert_experiment_data_to_wide_table(tag)
-    retention_report_table_ETL.main(tag)
-
-    insert_experiment_data_to_wide_active_table(tag)
-    retention_report_table_active_ETL.main(tag)
-
-    Active_Retention_overall.main(tag)
-    First_Retention_overall.main(tag)
+    run_dag(build_jobs(), tag, max_concurrency=max_concurrency)
 
-    # generate_rate.main(tag)
 
-    # test_country.main(tag)
-def main(tag):
-    run_experiment_data_etl(tag)
+def main(tag, max_concurrency=None):
+    run_experiment_data_etl(tag, max_concurrency=max_concurrency)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from pipeline.arrow_fetch import fetch_df
+from pipeline.sufficient_stats import stats_table_name
+
+# ============= 基于充分统计量的检验 =============
+# 输入是 tbl_report_metric_stats_{tag} 的行（n, Σx, Σx², Σy, Σy², Σxy），不需要用户明细：
+# 均值 / 方差 / t 检验 / 置信区间都由这几列直接算出，毫秒级。
+
+
+def load_stats(tag, metric, grain="daily", start_date=None, end_date=None):
+    """读取某个指标的统计量；overall 粒度不按日期过滤。"""
+    query = f"""
+    SELECT event_date, variation_id, n, sum_x, sum_x2, sum_y, sum_y2, sum_xy
+    FROM {stats_table_name(tag)}
+    WHERE metric = '{metric}' AND grain = '{grain}'
+    """
+    if start_date and end_date and grain != "overall":
+        query += f" AND event_date BETWEEN '{start_date}' AND '{end_date}'"
+    return fetch_df(query)
+
+
+def pool_stats(df, keys=("variation_id",)):
+    """按 keys 合并统计量（各列直接相加），例如把每日统计量合成整个实验期。"""
+    columns = ["n", "sum_x", "sum_x2", "sum_y", "sum_y2", "sum_xy"]
+    return df.groupby(list(keys), as_index=False)[columns].sum(min_count=1)
+
+
+def moments(df):
+    """
+    每行的点估计和其标准误平方：
+    - 非比率指标（sum_y 为空）：均值 Σx / n，方差用样本方差 (Σx² - n·x̄²) / (n - 1)
+    - 比率指标：Σx / Σy，方差用 delta 方法，由 Σx²、Σy²、Σxy 算出 x、y 的方差和协方差
+    返回带 estimate / se2 两列的新 DataFrame。
+    """
+    df = df.copy()
+    n = df["n"].astype(float)
+    mean_x = df["sum_x"] / n
+    var_x = (df["sum_x2"] - n * mean_x ** 2) / (n - 1)
+
+    mean_y = df["sum_y"] / n
+    var_y = (df["sum_y2"] - n * mean_y ** 2) / (n - 1)
+    cov_xy = (df["sum_xy"] - n * mean_x * mean_y) / (n - 1)
+    ratio = mean_x / mean_y
+    ratio_se2 = (var_x - 2 * ratio * cov_xy + ratio ** 2 * var_y) / (n * mean_y ** 2)
+
+    is_ratio = df["sum_y"].notna()
+    df["estimate"] = np.where(is_ratio, ratio, mean_x)
+    df["se2"] = np.where(is_ratio, ratio_se2, var_x / n)
+    return df
+
+
+def compare_to_control(df, control="0", keys=(), ci=0.95):
+    """
+    每个实验组与同 keys 的对照组做 Welch t 检验（比率指标为 delta 方法 z 检验）：
+    返回 control_estimate / exp_estimate / uplift / diff_ci_lower / diff_ci_upper / p_value。
+    """
+    df = moments(df)
+    df["variation_id"] = df["variation_id"].astype(str)
+    keys = list(keys)
+    df["_key"] = 0   # 无 keys（整体统计量）时也能按同一方式配对
+    control_df = (df[df["variation_id"] == str(control)][keys + ["_key", "n", "estimate", "se2"]]
+                  .rename(columns={"n": "_c_n", "estimate": "control_estimate", "se2": "_c_se2"}))
+    pairs = df[df["variation_id"] != str(control)].merge(control_df, on=keys + ["_key"], how="inner")
+    pairs = pairs.rename(columns={"estimate": "exp_estimate"})
+
+    diff = pairs["exp_estimate"] - pairs["control_estimate"]
+    se = np.sqrt(pairs["se2"] + pairs["_c_se2"])
+    # Welch–Satterthwaite 自由度；比率指标样本量大，t 分布与正态几乎一致
+    dof = (pairs["se2"] + pairs["_c_se2"]) ** 2 / (
+        pairs["se2"] ** 2 / (pairs["n"] - 1) + pairs["_c_se2"] ** 2 / (pairs["_c_n"] - 1))
+    t_crit = stats.t.ppf(1 - (1 - ci) / 2, dof)
+
+    pairs["uplift"] = np.where(pairs["control_estimate"] != 0, diff / pairs["control_estimate"], 0.0)
+    pairs["diff_ci_lower"] = diff - t_crit * se
+    pairs["diff_ci_upper"] = diff + t_crit * se
+    pairs["p_value"] = 2 * stats.t.sf(np.abs(diff / se), dof)
+    columns = keys + ["variation_id", "control_estimate", "exp_estimate", "uplift",
+                      "diff_ci_lower", "diff_ci_upper", "p_value"]
+    return pairs[columns].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    # 自检：由统计量算出的 t 检验与直接用用户明细的 scipy Welch t 检验一致
+    rng = np.random.default_rng(0)
+    control_x = rng.exponential(3.0, 20000)
+    exp_x = rng.exponential(3.1, 20000)
+    rows = [{"variation_id": v, "n": len(x), "sum_x": x.sum(), "sum_x2": (x ** 2).sum(),
+             "sum_y": np.nan, "sum_y2": np.nan, "sum_xy": np.nan}
+            for v, x in (("0", control_x), ("1", exp_x))]
+    result = compare_to_control(pd.DataFrame(rows))
+    expected = stats.ttest_ind(exp_x, control_x, equal_var=False)
+    print(result)
+    assert abs(result["p_value"].iloc[0] - expected.pvalue) < 1e-9
+    print(f"🧪 统计量 t 检验与明细一致：p = {round(expected.pvalue, 6)}")
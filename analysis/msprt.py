@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+from scipy import stats
+
+# ============= mSPRT 始终有效检验 =============
+# 混合序贯概率比检验（正态混合先验 N(0, τ²)）：每天看一次结果也不会放大一类错误。
+# 输入只需当前累计的差值估计 diff 及其方差 V（由充分统计量的 delta 方法得到）：
+#   Λ = sqrt(V / (V + τ²)) · exp(diff² · τ² / (2V(V + τ²)))，p = min(1, 1/Λ)
+# p 值取历史最小值、置信区间取历史交集，保证对任意停止时间都有效。
+MSPRT_ALPHA = float(os.getenv("MSPRT_ALPHA", "0.05"))
+MSPRT_TAU = float(os.getenv("MSPRT_TAU", "0.05"))   # 混合先验的尺度：预期的相对效应量（对照组均值的比例）
+
+
+def mixing_variance(control_estimate, variance, tau=MSPRT_TAU):
+    """τ² = (tau · 对照组均值)²；对照组均值为 0 时退化为当前方差。首次计算后固定，保存在状态表中。"""
+    control_estimate = np.asarray(control_estimate, dtype=float)
+    tau2 = (tau * control_estimate) ** 2
+    return np.where(tau2 > 0, tau2, np.asarray(variance, dtype=float))
+
+
+def msprt_p_value(diff, variance, tau2):
+    """当前时刻的 mSPRT p 值（未取历史最小）；方差无效时记 1。"""
+    diff, variance, tau2 = (np.asarray(x, dtype=float) for x in (diff, variance, tau2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_lr = 0.5 * np.log(variance / (variance + tau2)) + diff ** 2 * tau2 / (2 * variance * (variance + tau2))
+        p = np.exp(-np.maximum(log_lr, 0.0))
+    return np.where((variance > 0) & np.isfinite(p), p, 1.0)
+
+
+def msprt_interval(diff, variance, tau2, alpha=MSPRT_ALPHA):
+    """当前时刻的 1 - alpha 置信序列：diff ± sqrt(2V(V + τ²)/τ² · (½·log((V + τ²)/V) - log α))。"""
+    diff, variance, tau2 = (np.asarray(x, dtype=float) for x in (diff, variance, tau2))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        half = np.sqrt(2 * variance * (variance + tau2) / tau2
+                       * (0.5 * np.log((variance + tau2) / variance) - np.log(alpha)))
+    half = np.where((variance > 0) & np.isfinite(half), half, np.inf)
+    return diff - half, diff + half
+
+
+def running_update(p_value, ci_lower, ci_upper, new_p, new_lower, new_upper):
+    """把本次结果并入历史：p 取最小，区间取交集（NaN 表示还没有历史）。"""
+    return (np.fmin(p_value, new_p),
+            np.fmax(ci_lower, new_lower),
+            np.fmin(ci_upper, new_upper))
+
+
+if __name__ == "__main__":
+    # 自检：A/A 场景下每天偷看，固定样本 z 检验的累计误报率明显超过 alpha，mSPRT 不超过
+    rng = np.random.default_rng(0)
+    n_sims, n_days, daily_users = 2000, 30, 500
+    z_crit = stats.norm.ppf(1 - MSPRT_ALPHA / 2)
+    naive_hits, msprt_hits = 0, 0
+    for _ in range(n_sims):
+        a = rng.normal(10, 3, (n_days, daily_users))
+        b = rng.normal(10, 3, (n_days, daily_users))
+        n = daily_users * np.arange(1, n_days + 1)
+        diff = np.cumsum(b.sum(axis=1)) / n - np.cumsum(a.sum(axis=1)) / n
+        variance = 2 * 9 / n
+        tau2 = mixing_variance(10.0, variance[0])
+        naive_hits += np.any(np.abs(diff) / np.sqrt(variance) > z_crit)
+        msprt_hits += np.minimum.accumulate(msprt_p_value(diff, variance, tau2))[-1] < MSPRT_ALPHA
+    print(f"📐 每日偷看 {n_days} 天：固定样本误报率 {round(naive_hits / n_sims, 3)}，"
+          f"mSPRT 误报率 {round(msprt_hits / n_sims, 3)}（alpha={MSPRT_ALPHA}）")
+    assert msprt_hits / n_sims <= MSPRT_ALPHA + 0.01
@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+from scipy import stats
+
+# ============= 连续指标共轭后验（Normal-Inverse-Gamma） =============
+# ARPU 这类连续指标按用户级 n / Σx / Σx² 计算后验：均值的边际后验是 Student-t，
+# 胜率和 uplift 区间都有解析式，不需要抽样；样本量越大区间越窄，而不是固定的 arpu/5。
+
+# 默认参考先验（kappa=0, alpha=-1/2, beta=0）：后验 t(n-1, x̄, s²/n)，与经典 t 区间一致
+PRIOR = {"mu": 0.0, "kappa": 0.0, "alpha": -0.5, "beta": 0.0}
+
+
+def nig_params(n, sum_x, sum_x2, prior=PRIOR):
+    """
+    NIG 共轭更新，返回均值边际后验 Student-t 的 (位置, 尺度², 自由度)：
+    kappa_n = kappa + n，mu_n = (kappa·mu + Σx) / kappa_n，alpha_n = alpha + n/2，
+    beta_n = beta + (Σx² - n·x̄²)/2 + kappa·n·(x̄ - mu)² / (2·kappa_n)，
+    μ ~ t(2·alpha_n, mu_n, beta_n / (alpha_n·kappa_n))。
+    """
+    n = np.atleast_1d(np.asarray(n, dtype=float))
+    sum_x = np.atleast_1d(np.asarray(sum_x, dtype=float))
+    sum_x2 = np.atleast_1d(np.asarray(sum_x2, dtype=float))
+    mean = np.divide(sum_x, n, out=np.zeros_like(sum_x), where=n > 0)
+    ss = np.maximum(sum_x2 - n * mean ** 2, 0.0)   # 浮点误差可能让平方和略小于 0
+
+    kappa_n = prior["kappa"] + n
+    mu_n = (prior["kappa"] * prior["mu"] + sum_x) / kappa_n
+    alpha_n = prior["alpha"] + n / 2
+    beta_n = prior["beta"] + ss / 2 + prior["kappa"] * n * (mean - prior["mu"]) ** 2 / (2 * kappa_n)
+    return mu_n, beta_n / (alpha_n * kappa_n), 2 * alpha_n
+
+
+def normal_compare(mu_c, scale2_c, dof_c, mu_e, scale2_e, dof_e, ci=0.95):
+    """
+    对齐的 (对照, 实验) 格子解析比较，返回与 beta_compare 相同的键：
+    - chance_to_win：P(μ_e > μ_c)，差值按 Welch–Satterthwaite 自由度的 t 分布计算
+    - uplift / uplift_ci_lower / uplift_ci_upper：(μ_e - μ_c) / μ_c 及其 delta 方法区间，control_mean 为 0 时记 0
+    """
+    mu_c, scale2_c, dof_c, mu_e, scale2_e, dof_e = (np.atleast_1d(np.asarray(x, dtype=float))
+                                                    for x in (mu_c, scale2_c, dof_c, mu_e, scale2_e, dof_e))
+    diff = mu_e - mu_c
+    var_diff = scale2_e + scale2_c
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dof = var_diff ** 2 / (scale2_e ** 2 / dof_e + scale2_c ** 2 / dof_c)
+        dof = np.where(np.isfinite(dof), dof, np.minimum(dof_c, dof_e))
+        z = diff / np.sqrt(var_diff)
+        chance = np.where(var_diff > 0, stats.t.cdf(z, dof), np.where(diff > 0, 1.0, np.where(diff < 0, 0.0, 0.5)))
+
+        safe_c = np.where(mu_c != 0, mu_c, 1.0)
+        uplift = np.where(mu_c != 0, diff / safe_c, 0.0)
+        uplift_se = np.sqrt(scale2_e / safe_c ** 2 + mu_e ** 2 * scale2_c / safe_c ** 4)
+        half_width = np.where(mu_c != 0, stats.t.ppf(1 - (1 - ci) / 2, dof) * uplift_se, 0.0)
+
+    return {
+        "control_mean": mu_c,
+        "exp_mean": mu_e,
+        "uplift": uplift,
+        "uplift_ci_lower": uplift - half_width,
+        "uplift_ci_upper": uplift + half_width,
+        "chance_to_win": chance,
+    }
+
+
+def compare_sums(control, n, sum_x, sum_x2, ci=0.95, prior=PRIOR):
+    """
+    control：对照组 (n, Σx, Σx²)；n / sum_x / sum_x2：各实验组的数组。
+    所有实验组一次向量化比较，返回 normal_compare 的结果。
+    """
+    mu_c, scale2_c, dof_c = nig_params(*control, prior=prior)
+    mu_e, scale2_e, dof_e = nig_params(n, sum_x, sum_x2, prior=prior)
+    k = len(mu_e)
+    return normal_compare(np.repeat(mu_c, k), np.repeat(scale2_c, k), np.repeat(dof_c, k),
+                          mu_e, scale2_e, dof_e, ci=ci)
+
+
+def compare_variations(stats_df, variations, control="0", ci=0.95, prior=PRIOR):
+    """
+    stats_df：充分统计量表的行（overall 粒度，含 variation_id / n / sum_x / sum_x2）；
+    返回与 variations 对齐的比较结果，缺少统计量的实验组为 NaN；没有对照组统计量时返回 None。
+    """
+    sums = (stats_df.assign(variation_id=stats_df["variation_id"].astype(str))
+            .groupby("variation_id")[["n", "sum_x", "sum_x2"]].sum())
+    if str(control) not in sums.index:
+        return None
+    aligned = sums.reindex([str(v) for v in variations])
+    result = compare_sums(tuple(sums.loc[str(control)]), aligned["n"], aligned["sum_x"], aligned["sum_x2"],
+                          ci=ci, prior=prior)
+    missing = aligned["n"].isna().to_numpy()
+    for key in ("exp_mean", "uplift", "uplift_ci_lower", "uplift_ci_upper", "chance_to_win"):
+        result[key] = np.where(missing, np.nan, result[key])
+    return result
+
+
+if __name__ == "__main__":
+    # 自检：解析胜率与 Student-t 后验抽样一致
+    rng = np.random.default_rng(0)
+    control_x = rng.exponential(2.0, 50000) * (rng.random(50000) < 0.05)
+    exp_x = rng.exponential(2.1, 50000) * (rng.random(50000) < 0.05)
+    sums = [(len(x), x.sum(), (x ** 2).sum()) for x in (control_x, exp_x)]
+
+    t0 = time.perf_counter()
+    result = compare_sums(sums[0], *sums[1])
+    t1 = time.perf_counter()
+
+    mu_c, scale2_c, dof_c = nig_params(*sums[0])
+    mu_e, scale2_e, dof_e = nig_params(*sums[1])
+    draws_c = mu_c + np.sqrt(scale2_c) * rng.standard_t(dof_c, 400000)
+    draws_e = mu_e + np.sqrt(scale2_e) * rng.standard_t(dof_e, 400000)
+    sampled = np.mean(draws_e > draws_c)
+    print({key: round(float(value[0]), 6) for key, value in result.items()})
+    print(f"⏱️ 解析计算 {round((t1 - t0) * 1000, 2)} ms；抽样胜率 {round(sampled, 4)}")
+    assert abs(result["chance_to_win"][0] - sampled) < 0.01
+    print("🧪 解析胜率与后验抽样一致")
@@ -1,24 +1,11 @@
-import time
 from chat_click_show.active import  start_chat_rate_2, Time_spent,  \
      click_rate_1, chat_round_3, avg_bot_click_4, first_chat_bot_5
 from chat_click_show.explore import show_click_rate_1_3, explore_start_chat_rate_2, Chat_round_4
 from growthbook_fetcher.growthbook_data_ETL import fetch_and_save_experiment_data
+from pipeline.scheduler import job, run_dag
 
-fetch_and_save_experiment_data()
-
-def run_event(event_name, event_func, tag):
-    print(f"\n🚀 开始执行 {event_name} 事件，标签：{tag}")
-    start_time = time.time()
-    try:
-        event_func(tag)
-        print(f"✅ {event_name} 事件执行完成，耗时：{round(time.time() - start_time, 2)}秒")
-    except Exception as e:
-        print(f"❌ {event_name} 事件执行失败，错误信息：{e}")
-
-
-def main(tag):
-    print(f"\n🎬 【主流程启动】标签：{tag}\n")
 
+def build_jobs():
     events = [
         ("click_rate_1", click_rate_1.main),
         # ("start_chat_rate_2", start_chat_rate_2.main),
@@ -32,9 +19,13 @@ def main(tag):
         ("Chat_depth_4", Chat_round_4.main)
     ]
 
-    for event_name, event_func in events:
-        run_event(event_name, event_func, tag)
+    # 各点击/聊天指标互相独立，可并发执行
+    return [job(event_name, event_func) for event_name, event_func in events]
+
 
+def main(tag, max_concurrency=None):
+    print(f"\n🎬 【主流程启动】标签：{tag}\n")
+    run_dag(build_jobs(), tag, max_concurrency=max_concurrency)
     print("\n🎉 【所有事件处理完毕】")
 
 
@@ -1,3 +1,4 @@
+import argparse
 import warnings
 from symbol import subscript
 
@@ -10,43 +11,77 @@ from Retention import Main_Retention
 from Subscribe import subscribe, sub, first_new_sub
 from chat_click_show import Main_Chat_click_show
 from growthbook_fetcher.growthbook_data_ETL import fetch_and_save_experiment_data
+from pipeline.assignment import get_assignment_table
+from pipeline.checkpoint import set_resume
+from pipeline.db_engine import log_pool_stats
+from pipeline.estimate import set_estimate_mode
+from pipeline.query_log import enable_query_log, print_slowest_queries
+from pipeline.scheduler import job, run_dag
+from pipeline import sequential_testing
+from pipeline.watermark import set_full_refresh
 
 warnings.filterwarnings("ignore", category=NotOpenSSLWarning)
 import warnings
 from sqlalchemy.exc import SAWarning
 warnings.filterwarnings("ignore", category=SAWarning)
 
-# 获取并保存 GzrowthBook 实验数据
+# 获取并保存 GrowthBook 实验数据（全量分页 + 本地 ETag 缓存，本进程只同步一次）
 fetch_and_save_experiment_data()
 
-# 定义实验标签
-tag = 'mobile_new'
-
-
-# 1.留存计算
-Main_Retention.main(tag)
-
-# 2.聊天点击
-Main_Chat_click_show.main(tag)
-
-# 3.engagement 互动功能
-Main_Engagement.main(tag)
+# 命令行参数：实验标签；--full-refresh 忽略水位按整个实验周期重算（回溯补数）；
+# --resume 只补跑上次失败或中断的日期 / 分批；--estimate 日内检查用 HLL 估算去重用户数（结果标记为估算）
+parser = argparse.ArgumentParser()
+parser.add_argument("--tag", default="mobile_new")
+parser.add_argument("--full-refresh", action="store_true")
+parser.add_argument("--resume", action="store_true")
+parser.add_argument("--estimate", action="store_true")
+args = parser.parse_args()
 
-# 4.business 商业化
-Main_business.main(tag)
-
-# 5.充值计算
-recharge.main(tag)
-recharge_summury.main(tag)
-
-# 6.subscribe 订阅
-subscribe.get_daily_subscribe_metrics_with_subscribe_rate(tag)
-sub.get_and_save_daily_order_rate_by_experiment(tag)
-first_new_sub.get_and_save_first_subscribe_rate_by_experiment(tag)
-
-# 7.advertisement.main(tag)
+# 定义实验标签
+tag = args.tag
+set_full_refresh(args.full_refresh)
+set_resume(args.resume)
+set_estimate_mode(args.estimate)
+# 语句级埋点：每条 SQL 的耗时 / 行数 / query_id 写入 tbl_pipeline_run_log 和本地 JSONL
+enable_query_log(tag)
+
+
+# 同一集群同时执行的指标任务上限（默认读取环境变量 STARROCKS_MAX_CONCURRENCY）
+max_concurrency = None
+
+# 先物化（增量刷新）首次分流表，后续所有指标任务直接 JOIN，不再各自开窗去重
+get_assignment_table(tag)
+
+jobs = [
+    # 1.留存计算
+    *Main_Retention.build_jobs(),
+    # 2.聊天点击
+    *Main_Chat_click_show.build_jobs(),
+    # 3.engagement 互动功能
+    *Main_Engagement.build_jobs(),
+    # 4.business 商业化
+    *Main_business.build_jobs(),
+    # 5.充值计算
+    job("recharge", recharge.main),
+    job("recharge_summury", recharge_summury.main, deps=["recharge"]),
+    # 6.subscribe 订阅
+    job("subscribe", subscribe.get_daily_subscribe_metrics_with_subscribe_rate),
+    job("sub", sub.get_and_save_daily_order_rate_by_experiment),
+    job("first_new_sub", first_new_sub.get_and_save_first_subscribe_rate_by_experiment),
+    # 7.序贯检验：由每日充分统计量增量更新 mSPRT 状态，发布始终有效的 p 值 / 置信区间
+    job("sequential_testing", sequential_testing.main,
+        deps=["retention_wide", "chat_send_fused", "revenue_metrics"]),
+]
+run_dag(jobs, tag, max_concurrency=max_concurrency)
+
+# 8.advertisement.main(tag)
 # advertisement_sum.main(tag)
 
+# 连接池统计：checkout 次数 / 实际握手次数 / 节省的握手耗时
+log_pool_stats(tag)
+# 本次运行最慢的语句（按 query_id 在 FE 上查看 Profile）
+print_slowest_queries()
+
 
 
 
@@ -0,0 +1,148 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+import pymysql
+from pymysql.constants import FIELD_TYPE
+
+from pipeline.db_engine import DB_HOST, DB_USER, get_engine
+from pipeline.query_log import logged_statement
+
+# pyarrow / ADBC Flight SQL 驱动为可选依赖：未安装时走 pymysql 流式读取
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - 取决于运行环境
+    pa = None
+
+try:
+    from adbc_driver_flightsql import dbapi as flight_sql
+except ImportError:  # pragma: no cover - 取决于运行环境
+    flight_sql = None
+
+# ============= 列式读取配置 =============
+# STARROCKS_FLIGHT_PORT 为 FE 的 arrow_flight_port，配置后优先走 Arrow Flight SQL，结果直接是列式 Arrow 数据
+FLIGHT_PORT = os.getenv("STARROCKS_FLIGHT_PORT", "")
+FETCH_BATCH_ROWS = int(os.getenv("FETCH_BATCH_ROWS", "50000"))   # pymysql 流式读取时每批转换的行数
+
+_INT_TYPES = {FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24,
+              FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR}
+_FLOAT_TYPES = {FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE, FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL}
+
+_flight_disabled = False
+
+
+def _flight_enabled():
+    return bool(FLIGHT_PORT) and flight_sql is not None and not _flight_disabled
+
+
+def _fetch_flight(query):
+    with logged_statement(query) as log, flight_sql.connect(
+        f"grpc://{DB_HOST}:{FLIGHT_PORT}",
+        db_kwargs={"username": DB_USER, "password": os.environ["DB_PASSWORD"]},
+    ) as conn, conn.cursor() as cursor:
+        cursor.execute(query)
+        table = cursor.fetch_arrow_table()
+        log["row_count"] = table.num_rows
+        return table
+
+
+def _column_kind(type_code):
+    if type_code in _INT_TYPES:
+        return "int"
+    if type_code in _FLOAT_TYPES:
+        return "float"
+    return "object"
+
+
+def _to_array(values, kind):
+    """一批值 → 定长 NumPy 列：整数 int64（含 NULL 时 float64 + NaN，与 pd.read_sql 一致），小数 float64，其余 object。"""
+    if kind == "int":
+        if None in values:
+            return np.array([np.nan if v is None else v for v in values], dtype="float64")
+        return np.fromiter(values, dtype="int64", count=len(values))
+    if kind == "float":
+        return np.fromiter((np.nan if v is None else float(v) for v in values), dtype="float64", count=len(values))
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _fetch_columns(query, engine):
+    """
+    pymysql 流式游标（SSCursor）按 FETCH_BATCH_ROWS 分批取数，每批立即转置成 NumPy 列，
+    不在内存中保留整个结果集的行元组；DECIMAL 直接转 float64，不再是逐个的 Decimal 对象。
+    raw 连接不触发 SQLAlchemy 游标事件，由 logged_statement 计入语句埋点。
+    返回 (列名, 列数组)。
+    """
+    raw_conn = engine.raw_connection()
+    try:
+        with logged_statement(query, raw_conn) as log:
+            cursor = raw_conn.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(query)
+                names = [d[0] for d in cursor.description]
+                kinds = [_column_kind(d[1]) for d in cursor.description]
+                chunks = [[] for _ in names]
+                log["row_count"] = 0
+                while True:
+                    rows = cursor.fetchmany(FETCH_BATCH_ROWS)
+                    if not rows:
+                        break
+                    log["row_count"] += len(rows)
+                    for i, values in enumerate(zip(*rows)):
+                        chunks[i].append(_to_array(values, kinds[i]))
+            finally:
+                cursor.close()
+    finally:
+        raw_conn.close()
+
+    columns = []
+    for kind, parts in zip(kinds, chunks):
+        if parts:
+            columns.append(np.concatenate(parts))
+        else:
+            columns.append(np.empty(0, dtype="int64" if kind == "int" else "float64" if kind == "float" else object))
+    return names, columns
+
+
+def fetch_arrow(query, engine=None):
+    """
+    返回 Arrow Table：配置了 Flight 端口时直接从 StarRocks 取列式结果，否则由 pymysql 流式读取的 NumPy 列构建。
+    需要安装 pyarrow。
+    """
+    global _flight_disabled
+    if _flight_enabled():
+        try:
+            return _fetch_flight(query)
+        except Exception as e:
+            _flight_disabled = True
+            logging.warning(f"⚠️ Arrow Flight 读取失败，本进程改用 pymysql：{e}")
+    if pa is None:
+        raise ImportError("fetch_arrow 需要安装 pyarrow")
+    names, columns = _fetch_columns(query, engine or get_engine())
+    return pa.Table.from_arrays([pa.array(c) for c in columns], names=names)
+
+
+def _arrow_to_pandas(table):
+    # 整数列统一为 int64，和 pymysql 路径 / 原 pd.read_sql 的类型一致，避免下游窄整型运算溢出
+    fields = [pa.field(f.name, pa.int64()) if pa.types.is_integer(f.type) else f for f in table.schema]
+    return table.cast(pa.schema(fields)).to_pandas(date_as_object=True)
+
+
+def fetch_df(query, engine=None):
+    """
+    pd.read_sql 的替代：列式读取后直接组装 DataFrame，调用方式与返回类型保持不变。
+    Flight 可用时走 Arrow；否则走 pymysql 流式 NumPy 列，不依赖 pyarrow。
+    """
+    global _flight_disabled
+    if _flight_enabled() and pa is not None:
+        try:
+            return _arrow_to_pandas(_fetch_flight(query))
+        except Exception as e:
+            _flight_disabled = True
+            logging.warning(f"⚠️ Arrow Flight 读取失败，本进程改用 pymysql：{e}")
+    names, columns = _fetch_columns(query, engine or get_engine())
+    df = pd.DataFrame({i: column for i, column in enumerate(columns)})
+    df.columns = names
+    return df
@@ -0,0 +1,122 @@
+import os
+import threading
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from growthbook_fetcher.experiment_tag_all_parameters import get_experiment_details_by_tag
+from pipeline.db_engine import get_engine
+from pipeline.watermark import is_full_refresh
+
+# 增量刷新时向前回看的小时数，兜住分流表里迟到写入的记录
+ASSIGNMENT_LOOKBACK_HOURS = int(os.getenv("ASSIGNMENT_LOOKBACK_HOURS", "6"))
+
+_refreshed = set()
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def assignment_table_name(tag):
+    return f"flow_ab_test.tbl_wide_experiment_first_assignment_{tag}"
+
+
+def _tag_lock(tag):
+    with _locks_guard:
+        return _locks.setdefault(tag, threading.Lock())
+
+
+def refresh_assignment_table(tag, experiment_name=None, full_refresh=False):
+    """
+    物化每个用户在实验中的首次分流记录 (user_id, variation, first_assigned_ts, first_assigned_date)。
+    - 首次运行或实验切换时全量构建
+    - 之后按 first_assigned_ts 水位增量追加新用户，已有用户保持首次分组不变
+    """
+    if experiment_name is None:
+        experiment_data = get_experiment_details_by_tag(tag)
+        if not experiment_data:
+            print(f"⚠️ 没有找到符合标签 '{tag}' 的实验数据，无法物化分流表！")
+            return None
+        experiment_name = experiment_data["experiment_name"]
+
+    table_name = assignment_table_name(tag)
+    create_table_query = f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        user_id VARCHAR(255) NOT NULL,
+        experiment_name VARCHAR(255),
+        variation VARCHAR(255),
+        first_assigned_ts DATETIME,
+        first_assigned_date DATE
+    ) ENGINE=OLAP
+    PRIMARY KEY(user_id)
+    DISTRIBUTED BY HASH(user_id) BUCKETS 10
+    PROPERTIES ("replication_num" = "3");
+    """
+
+    engine = get_engine()
+    with engine.connect() as conn:
+        conn.execute(text("SET query_timeout = 30000;"))
+        conn.execute(text(create_table_query))
+
+        existing = conn.execute(text(
+            f"SELECT MAX(experiment_name) AS experiment_name, MAX(first_assigned_ts) AS watermark FROM {table_name}"
+        )).mappings().fetchone()
+        if full_refresh or existing["experiment_name"] != experiment_name or existing["watermark"] is None:
+            conn.execute(text(f"TRUNCATE TABLE {table_name};"))
+            time_filter = ""
+            print(f"🔄 全量构建分流表 {table_name}，实验：{experiment_name}")
+        else:
+            since = existing["watermark"] - timedelta(hours=ASSIGNMENT_LOOKBACK_HOURS)
+            time_filter = f"AND timestamp_assigned >= '{since}'"
+            print(f"🔄 增量刷新分流表 {table_name}，水位：{existing['watermark']}")
+
+        insert_query = f"""
+        INSERT INTO {table_name} (user_id, experiment_name, variation, first_assigned_ts, first_assigned_date)
+        SELECT
+            t.user_id,
+            '{experiment_name}' AS experiment_name,
+            CAST(t.variation_id AS CHAR) AS variation,
+            t.timestamp_assigned AS first_assigned_ts,
+            DATE(t.timestamp_assigned) AS first_assigned_date
+        FROM (
+            SELECT user_id, variation_id, timestamp_assigned,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = '{experiment_name}'
+              {time_filter}
+        ) t
+        LEFT JOIN {table_name} m ON t.user_id = m.user_id
+        WHERE t.rn = 1
+          AND m.user_id IS NULL;
+        """
+        conn.execute(text(insert_query))
+    print(f"✅ 分流表 {table_name} 已刷新。")
+    return table_name
+
+
+def window_assignment_sql(experiment_name, assign_start, assign_end):
+    """
+    返回 (user_id, variation) 子查询：每个用户在 [assign_start, assign_end] 内的首次分流。
+    先按时间窗过滤再开窗取第一条，与留存宽表 / test_country 原口径一致——
+    全局首次分流早于窗口的用户按窗口内的第一条分组，物化表的全局首次分流回答不了，这里仍读小时分流表。
+    """
+    return f"""
+        SELECT user_id, CAST(variation_id AS CHAR) AS variation
+        FROM (
+            SELECT user_id, variation_id,
+                   ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp_assigned ASC) AS rn
+            FROM flow_wide_info.tbl_wide_experiment_assignment_hi
+            WHERE experiment_id = '{experiment_name}'
+              AND timestamp_assigned BETWEEN '{assign_start}' AND '{assign_end}'
+        ) t
+        WHERE rn = 1
+    """
+
+
+def get_assignment_table(tag, experiment_name=None):
+    """返回首次分流物化表名；同一进程内每个标签只刷新一次，供各指标模块直接 JOIN。"""
+    with _tag_lock(tag):
+        if tag not in _refreshed:
+            if refresh_assignment_table(tag, experiment_name, full_refresh=is_full_refresh()) is None:
+                return None
+            _refreshed.add(tag)
+    return assignment_table_name(tag)
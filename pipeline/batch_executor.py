@@ -0,0 +1,202 @@
+import contextvars
+import math
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from sqlalchemy import text
+
+from pipeline.checkpoint import begin_job, get_units, record_unit
+from pipeline.db_engine import get_engine
+from pipeline.query_log import query_scope
+
+# ============= CRC32 分批执行配置 =============
+BATCH_STATS_TABLE = "flow_ab_test.tbl_pipeline_batch_stats"
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))     # 单个任务同时执行的分批语句数
+BATCH_TARGET_SECONDS = float(os.getenv("BATCH_TARGET_SECONDS", "120"))  # 单条语句期望耗时，远低于 query_timeout
+BATCH_TARGET_ROWS = int(os.getenv("BATCH_TARGET_ROWS", "5000000"))     # 无历史耗时时，每批期望扫描的行数
+BATCH_MIN_COUNT = int(os.getenv("BATCH_MIN_COUNT", "4"))
+BATCH_MAX_COUNT = int(os.getenv("BATCH_MAX_COUNT", "256"))
+MAX_SPLIT_DEPTH = 2       # 失败（超时 / 超内存）的桶最多再对半拆分的层数
+SKEW_FACTOR = 3.0         # 单桶耗时超过中位数的倍数即视为倾斜
+
+_table_ready = False
+_table_lock = threading.Lock()
+
+
+def _ensure_table(conn):
+    global _table_ready
+    with _table_lock:
+        if _table_ready:
+            return
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {BATCH_STATS_TABLE} (
+            job_name VARCHAR(255) NOT NULL,
+            batch_count INT,
+            median_seconds DOUBLE,
+            max_seconds DOUBLE,
+            failed_buckets INT,
+            updated_at DATETIME
+        ) ENGINE=OLAP
+        PRIMARY KEY(job_name)
+        DISTRIBUTED BY HASH(job_name) BUCKETS 1
+        PROPERTIES ("replication_num" = "3");
+        """))
+        _table_ready = True
+
+
+def _clamp(count):
+    return max(BATCH_MIN_COUNT, min(BATCH_MAX_COUNT, int(count)))
+
+
+def choose_batch_count(job_name, estimate_query=None, default=20):
+    """
+    决定本次的分批数：
+    - 有上次运行记录：按最慢一批的耗时把批数缩放到 BATCH_TARGET_SECONDS 以内
+    - 否则若给出 estimate_query（返回一个行数的 SELECT）：按 BATCH_TARGET_ROWS 切分
+    - 都没有时使用 default
+    """
+    with get_engine().connect() as conn:
+        _ensure_table(conn)
+        row = conn.execute(text(
+            f"SELECT batch_count, max_seconds, failed_buckets FROM {BATCH_STATS_TABLE} WHERE job_name = '{job_name}'"
+        )).fetchone()
+        if row and row[0] and row[1]:
+            count = math.ceil(row[0] * row[1] / BATCH_TARGET_SECONDS)
+            if row[2]:
+                # 上次有桶需要拆分或最终失败，至少翻倍
+                count = max(count, row[0] * 2)
+            count = _clamp(count)
+            print(f"📐 {job_name} 分批数 {count}（上次 {row[0]} 批，最慢 {round(row[1], 1)} 秒，拆分 / 失败 {row[2]} 个）")
+            return count
+        if estimate_query:
+            rows = conn.execute(text(estimate_query)).scalar() or 0
+            count = _clamp(math.ceil(rows / BATCH_TARGET_ROWS))
+            print(f"📐 {job_name} 分批数 {count}（预估 {rows} 行）")
+            return count
+    print(f"📐 {job_name} 分批数 {default}（无历史记录，使用默认值）")
+    return default
+
+
+def _save_stats(job_name, batch_count, durations, failed_count):
+    median_seconds = statistics.median(durations) if durations else 0
+    max_seconds = max(durations) if durations else 0
+    with get_engine().connect() as conn:
+        _ensure_table(conn)
+        conn.execute(text(f"""
+            INSERT INTO {BATCH_STATS_TABLE} (job_name, batch_count, median_seconds, max_seconds, failed_buckets, updated_at)
+            VALUES ('{job_name}', {batch_count}, {median_seconds}, {max_seconds}, {failed_count}, NOW())
+        """))
+
+
+def crc32_filter(column, modulus, remainder):
+    return f"MOD(CRC32({column}), {modulus}) = {remainder}"
+
+
+def _split(bucket):
+    # 桶 (m, r) 恰好等于 (2m, r) ∪ (2m, r + m)，拆分后两条语句覆盖的用户不重不漏
+    modulus, remainder, depth = bucket
+    return [(modulus * 2, remainder, depth + 1), (modulus * 2, remainder + modulus, depth + 1)]
+
+
+def _resume_buckets(records, batch_count):
+    """
+    续跑时根据上次的单元记录决定需要重跑的桶：沿用上次的分批数，
+    已成功的桶跳过；上次被拆分过的桶沿拆分结果继续，只重跑其中未成功的子桶。
+    """
+    if not records:
+        return batch_count, [(batch_count, i, 0) for i in range(batch_count)]
+    base = min(modulus for modulus, _ in records)
+
+    def _expand(bucket):
+        modulus, remainder, depth = bucket
+        if records.get((modulus, remainder)) == "success":
+            return []
+        children = _split(bucket)
+        if any((m, r) in records for m, r, _ in children):
+            return [b for child in children for b in _expand(child)]
+        return [bucket]
+
+    return base, [b for i in range(base) for b in _expand((base, i, 0))]
+
+
+def begin_batch_job(tag, job_name):
+    """CRC32 分批任务的 begin_job：有中断的桶时不续跑（见 run_crc32_batches）。"""
+    return begin_job(tag, job_name, resume_interrupted=False)
+
+
+def run_crc32_batches(job_name, build_query, column, batch_count, max_concurrency=None, tag=None, unit_date=""):
+    """
+    按 MOD(CRC32(column), batch_count) 把一条重语句拆成多条，用连接池并发执行。
+    - build_query(batch_filter) 返回完整 INSERT 语句，batch_filter 为该桶的 WHERE 条件
+    - 单条 INSERT 失败时不会写入任何行，失败的桶对半拆分后重试（最多 MAX_SPLIT_DEPTH 层），
+      以应对数据倾斜导致的超时 / 超内存
+    - 耗时超过中位数 SKEW_FACTOR 倍的桶会被提示；每次的耗时写入统计表，供下次 choose_batch_count 调整批数
+    - 传入 tag 时每个桶作为一个断点单元 (tag, job_name, unit_date, "r/m") 记录状态，
+      --resume 时只重跑失败或缺失的桶（INSERT 原子，报错的桶没有写入）
+    - 桶没有逐桶清理：上次有中断（running）的桶时其 INSERT 是否已提交未知，
+      begin_batch_job 会放弃续跑，由调用方按正常流程清空结果表后整体重算，避免重复计数
+    返回最终仍失败的桶列表 [(modulus, remainder)]。
+    """
+    max_concurrency = max_concurrency or BATCH_MAX_CONCURRENCY
+    durations, failed = {}, []
+
+    pending = [(batch_count, i, 0) for i in range(batch_count)]
+    if tag is not None and begin_batch_job(tag, job_name):
+        records = {}
+        for batch, status in get_units(tag, job_name, unit_date).items():
+            remainder, modulus = batch.split("/")
+            records[(int(modulus), int(remainder))] = status
+        batch_count, pending = _resume_buckets(records, batch_count)
+        print(f"♻️ {job_name} {unit_date} 续跑 {len(pending)} 个分批（分批数沿用 {batch_count}）")
+
+    def _record(bucket, status, duration=None, error=None):
+        if tag is not None:
+            record_unit(tag, job_name, unit_date, f"{bucket[1]}/{bucket[0]}", status, duration, error)
+
+    def _run(bucket):
+        modulus, remainder, _ = bucket
+        _record(bucket, "running")
+        started_at = time.perf_counter()
+        with query_scope(unit=f"{unit_date} {remainder}/{modulus}".strip()), get_engine().connect() as conn:
+            conn.execute(text(build_query(crc32_filter(column, modulus, remainder))))
+        duration = time.perf_counter() - started_at
+        _record(bucket, "success", duration)
+        return duration
+
+    while pending:
+        retry = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            # 每个分批带上当前任务的埋点上下文（线程池默认不继承 contextvars）
+            futures = {pool.submit(contextvars.copy_context().run, _run, bucket): bucket for bucket in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                bucket = futures[future]
+                modulus, remainder, depth = bucket
+                try:
+                    durations[(modulus, remainder)] = future.result()
+                    print(f"✅ {job_name} 分批 {remainder}/{modulus} 完成（{done}/{len(pending)}），"
+                          f"耗时 {round(durations[(modulus, remainder)], 1)} 秒")
+                except Exception as e:
+                    _record(bucket, "failed", error=e)
+                    if depth < MAX_SPLIT_DEPTH:
+                        print(f"⚠️ {job_name} 分批 {remainder}/{modulus} 失败，拆分为两批重试：{e}")
+                        retry.extend(_split(bucket))
+                    else:
+                        print(f"🚨 {job_name} 分批 {remainder}/{modulus} 失败：{e}")
+                        failed.append((modulus, remainder))
+        pending = retry
+
+    values = list(durations.values())
+    if values:
+        median_seconds = statistics.median(values)
+        skewed = [k for k, v in durations.items() if median_seconds and v > SKEW_FACTOR * median_seconds]
+        if skewed:
+            print(f"⚖️ {job_name} 存在倾斜分批 {skewed}（中位数 {round(median_seconds, 1)} 秒），下次将自动增加批数。")
+    split_count = sum(1 for modulus, _ in durations if modulus != batch_count)
+    try:
+        _save_stats(job_name, batch_count, values, len(failed) + split_count)
+    except Exception as e:
+        print(f"⚠️ 分批耗时统计写入失败：{e}")
+    return failed
@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from pipeline.query_log import query_scope
+
+# ============= 断点续跑配置 =============
+# 本地 SQLite 记录每个执行单元 (tag, job, unit_date, batch) 的状态和耗时；--resume 时只重跑失败或缺失的单元
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join(".cache", "checkpoints.sqlite"))
+
+_resume = os.getenv("RESUME", "0") == "1"
+_db_lock = threading.Lock()
+_db_ready = False
+_job_modes = {}   # (tag, job) → 本进程内是否续跑，首次 begin_job 时确定
+
+
+def set_resume(flag):
+    """main_run --resume：本进程内已成功的单元直接跳过，只重跑失败或未执行的单元。"""
+    global _resume
+    _resume = bool(flag)
+
+
+def is_resume():
+    return _resume
+
+
+@contextmanager
+def _connect():
+    global _db_ready
+    os.makedirs(os.path.dirname(CHECKPOINT_DB) or ".", exist_ok=True)
+    conn = sqlite3.connect(CHECKPOINT_DB, timeout=30, isolation_level=None)
+    try:
+        if not _db_ready:
+            with _db_lock:
+                if not _db_ready:
+                    conn.execute("PRAGMA journal_mode=WAL;")
+                    conn.execute("""
+                    CREATE TABLE IF NOT EXISTS checkpoint_units (
+                        tag TEXT NOT NULL,
+                        job TEXT NOT NULL,
+                        unit_date TEXT NOT NULL,
+                        batch TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        duration REAL,
+                        error TEXT,
+                        updated_at REAL,
+                        PRIMARY KEY (tag, job, unit_date, batch)
+                    );
+                    """)
+                    _db_ready = True
+        yield conn
+    finally:
+        conn.close()
+
+
+def begin_job(tag, job, resume_interrupted=True):
+    """
+    任务开始时调用，返回是否处于续跑状态（--resume 且该任务上次有失败或中断的单元）。
+    非续跑时清空该任务的历史记录，本次从头记录；续跑时调用方应跳过 DROP / TRUNCATE 等破坏性准备步骤。
+    上次已全部成功的任务即使 --resume 也按正常流程重新计算。
+    resume_interrupted=False：单元没有执行前的幂等清理（如 CRC32 分批直接 INSERT 进结果表）时使用，
+    上次有中断（running）的单元则不续跑——其语句可能已提交，重跑会重复计数。
+    同一进程内同一任务只在首次调用时判定并清空一次（按天循环等多次调用结果一致）。
+    """
+    if (tag, job) in _job_modes:
+        return _job_modes[(tag, job)]
+    with _connect() as conn:
+        unfinished = conn.execute(
+            "SELECT COUNT(*) FROM checkpoint_units WHERE tag = ? AND job = ? AND status != 'success'", (tag, job)
+        ).fetchone()[0]
+        interrupted = conn.execute(
+            "SELECT COUNT(*) FROM checkpoint_units WHERE tag = ? AND job = ? AND status = 'running'", (tag, job)
+        ).fetchone()[0]
+        resuming = bool(_resume and unfinished and (resume_interrupted or not interrupted))
+        if resuming:
+            print(f"♻️ {job} 续跑：跳过已成功的单元，补跑 {unfinished} 个失败 / 中断的单元。")
+        else:
+            if _resume and unfinished:
+                print(f"⚠️ {job} 上次有 {interrupted} 个中断的单元，写入结果未知，本次按正常流程重新计算。")
+            elif _resume:
+                print(f"ℹ️ {job} 上次没有失败的单元，本次按正常流程重新计算。")
+            conn.execute("DELETE FROM checkpoint_units WHERE tag = ? AND job = ?", (tag, job))
+    _job_modes[(tag, job)] = resuming
+    return resuming
+
+
+def get_units(tag, job, unit_date=""):
+    """返回 {batch: status}。"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT batch, status FROM checkpoint_units WHERE tag = ? AND job = ? AND unit_date = ?",
+            (tag, job, str(unit_date)),
+        ).fetchall()
+    return dict(rows)
+
+
+def unit_done(tag, job, unit_date="", batch=""):
+    return bool(_job_modes.get((tag, job))) and get_units(tag, job, unit_date).get(str(batch)) == "success"
+
+
+def record_unit(tag, job, unit_date, batch, status, duration=None, error=None):
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO checkpoint_units (tag, job, unit_date, batch, status, duration, error, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (tag, job, str(unit_date), str(batch), status, duration, error and str(error)[:2000], time.time()),
+        )
+
+
+def run_unit(tag, job, unit_date, batch, func, cleanup=None):
+    """
+    执行一个单元并记录状态，返回是否成功：
+    - 续跑且该单元已成功：直接跳过
+    - cleanup：执行前的幂等清理（如 DELETE 该日期 / 日期块的数据），保证重试不会重复计数
+    - 失败只记录不抛出，由调用方汇总失败单元
+    """
+    if unit_done(tag, job, unit_date, batch):
+        print(f"⏭️ {job} {unit_date} {batch} 已完成，跳过。")
+        return True
+    record_unit(tag, job, unit_date, batch, "running")
+    started_at = time.perf_counter()
+    try:
+        with query_scope(unit=f"{unit_date} {batch}".strip()):
+            if cleanup:
+                cleanup()
+            func()
+    except Exception as e:
+        record_unit(tag, job, unit_date, batch, "failed", time.perf_counter() - started_at, e)
+        print(f"❌ {job} {unit_date} {batch} 失败：{e}")
+        return False
+    record_unit(tag, job, unit_date, batch, "success", time.perf_counter() - started_at)
+    return True
+
+
+def failed_units(tag, job=None):
+    """列出失败或中断（running）的单元，便于在日志中提示需要 --resume。"""
+    query = "SELECT job, unit_date, batch, status, error FROM checkpoint_units WHERE tag = ? AND status != 'success'"
+    params = [tag]
+    if job:
+        query += " AND job = ?"
+        params.append(job)
+    with _connect() as conn:
+        return conn.execute(query + " ORDER BY job, unit_date, batch", params).fetchall()
@@ -0,0 +1,17 @@
+from sqlalchemy import text
+
+from pipeline.db_engine import get_engine
+
+
+def compact_to_summary(table_name, columns, summary_query):
+    """
+    分批明细 → 汇总结果的服务端压缩：一条 INSERT OVERWRITE 把 summary_query 的结果原子替换进原表。
+    - summary_query 只能是 SELECT（可直接读 table_name 本身，读取的是覆盖前的快照）
+    - 不把数据拉回 Python，也没有 TRUNCATE 之后到写完之前的空表窗口
+    """
+    column_list = ", ".join(columns)
+    select_sql = summary_query.strip().rstrip(";")
+    with get_engine().connect() as conn:
+        conn.execute(text("SET query_timeout = 30000;"))
+        conn.execute(text(f"INSERT OVERWRITE {table_name} ({column_list})\n{select_sql};"))
+    print(f"✅ 表 {table_name} 已在服务端汇总并原子覆盖。")
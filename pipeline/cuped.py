@@ -0,0 +1,211 @@
+import os
+from datetime import timedelta
+from statistics import NormalDist
+
+from sqlalchemy import text
+
+from pipeline.compaction import compact_to_summary
+from pipeline.date_range import as_date
+from pipeline.db_engine import get_engine
+from pipeline.metric_registry import facts_sql, measure_columns
+from pipeline.sufficient_stats import STATS_COLUMNS, prepare_stats, stats_union_sql
+
+# ============= CUPED 方差缩减 =============
+# 协变量 = 同一指标在实验前 CUPED_PRE_DAYS 天的用户级取值。事件源在 [实验前窗口, 实验结束] 内只扫描一次，
+# 用户级 (y, x) 在 StarRocks 内聚合成 n、Σy、Σy²、Σx、Σx²、Σxy（统计量表 cuped 粒度），
+# θ、调整后均值和置信区间都由这些矩在服务端算出，用户明细不出仓。
+CUPED_PRE_DAYS = int(os.getenv("CUPED_PRE_DAYS", "14"))
+CUPED_CI = float(os.getenv("CUPED_CI", "0.95"))
+CUPED_GRAIN = "cuped"
+
+CUPED_COLUMNS = ["metric", "variation_id", "n", "pre_mean", "mean", "adjusted_mean", "theta",
+                 "variance_reduction", "se", "adjusted_se", "control_adjusted_mean", "diff", "uplift",
+                 "ci_lower", "ci_upper", "z_score", "experiment_tag"]
+
+CUPED_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    metric VARCHAR(128),
+    variation_id VARCHAR(255),
+    n BIGINT COMMENT '参与计算的用户数',
+    pre_mean DOUBLE COMMENT '实验前协变量均值',
+    mean DOUBLE COMMENT '未调整均值',
+    adjusted_mean DOUBLE COMMENT 'CUPED 调整后均值',
+    theta DOUBLE,
+    variance_reduction DOUBLE COMMENT '1 - 调整后方差 / 原方差',
+    se DOUBLE,
+    adjusted_se DOUBLE,
+    control_adjusted_mean DOUBLE,
+    diff DOUBLE COMMENT '调整后均值 - 对照组调整后均值',
+    uplift DOUBLE,
+    ci_lower DOUBLE,
+    ci_upper DOUBLE,
+    z_score DOUBLE,
+    experiment_tag VARCHAR(255)
+) ENGINE=OLAP
+DUPLICATE KEY(metric, variation_id)
+DISTRIBUTED BY HASH(metric) BUCKETS 4
+PROPERTIES ("replication_num" = "3");
+"""
+
+
+def cuped_table_name(tag):
+    return f"tbl_report_cuped_{tag}"
+
+
+def _check_metric(m):
+    """CUPED 按用户均值调整：分母为空（每个分流用户）或 users（分母内的用户）；sum / count 分母的比率指标不适用。"""
+    if m["denominator"] is not None and m["denominator"]["kind"] != "users":
+        raise ValueError(f"指标 {m['name']} 的分母为 {m['denominator']['kind']}，CUPED 只支持用户均值类指标")
+
+
+def _period_term_sql(term, measures, period):
+    """用户在某个时期（in / pre）的取值，读取 user_periods 中已按时期汇总的列；users 口径为 0/1。"""
+    columns = [measures[(source, term["filters"])] for source in term["sources"]]
+    if term["kind"] == "sum":
+        return " + ".join(f"{c}_{period}_sum" for c in columns)
+    counts = " + ".join(f"{c}_{period}_cnt" for c in columns)
+    if term["kind"] == "count":
+        return counts
+    return f"CASE WHEN {counts} > 0 THEN 1 ELSE 0 END"
+
+
+def compile_cuped_stats(metrics, assignment_table, first_day, last_day, pre_start, pre_end, experiment_tag):
+    """
+    编译 CUPED 矩的 SELECT（统计量表列，grain = cuped）：
+    每个分流用户一行，y = 实验期内（首次分流之后）的取值，x = 实验前窗口的取值；
+    users 分母的指标只统计分母内的用户（如 ARPU 只统计活跃用户）。
+    """
+    for m in metrics:
+        _check_metric(m)
+    measures = measure_columns(metrics)
+    periods = {
+        "in": f"f.event_date BETWEEN '{first_day}' AND '{last_day}' AND f.event_date >= e.first_assigned_date",
+        "pre": f"f.event_date BETWEEN '{pre_start}' AND '{pre_end}'",
+    }
+    # 未关联到事实的用户（LEFT JOIN 为空）条件为 NULL，落到 ELSE 0
+    period_columns = [f"SUM(CASE WHEN {condition} THEN f.{c}_{kind} ELSE 0 END) AS {c}_{period}_{kind}"
+                      for c in measures.values() for period, condition in periods.items() for kind in ("sum", "cnt")]
+
+    unit_columns, stats_metrics = [], []
+    for i, m in enumerate(metrics):
+        y_sql = _period_term_sql(m["numerator"], measures, "in")
+        x_sql = _period_term_sql(m["numerator"], measures, "pre")
+        if m["denominator"]:
+            member = _period_term_sql(m["denominator"], measures, "in")
+            y_sql = f"CASE WHEN {member} = 1 THEN {y_sql} ELSE 0 END"
+            x_sql = f"CASE WHEN {member} = 1 THEN {x_sql} ELSE 0 END"
+        else:
+            member = "1"
+        unit_columns.append(f"{member} AS m{i}_n")
+        unit_columns.append(f"{y_sql} AS m{i}_y")
+        unit_columns.append(f"{x_sql} AS m{i}_x")
+        # 统计量表约定：sum_x 为指标本身，sum_y 为协变量
+        stats_metrics.append((m["name"], f"m{i}_y", f"m{i}_x", f"m{i}_n = 1"))
+
+    period_sql = ",\n            ".join(period_columns)
+    unit_sql = ",\n            ".join(unit_columns)
+    return f"""
+    WITH{facts_sql(measures, pre_start, last_day)},
+    user_periods AS (
+        SELECT
+            e.variation AS variation_id,
+            e.user_id,
+            {period_sql}
+        FROM {assignment_table} e
+        LEFT JOIN facts f ON f.user_id = e.user_id
+        WHERE e.first_assigned_date <= '{last_day}'
+        GROUP BY e.variation, e.user_id
+    ),
+    units AS (
+        SELECT
+            CAST(NULL AS DATE) AS event_date,
+            variation_id,
+            user_id,
+            {unit_sql}
+        FROM user_periods
+    )
+    {stats_union_sql(stats_metrics, experiment_tag, CUPED_GRAIN)}
+    """
+
+
+def cuped_report_query(stats_table, metric_names, experiment_tag, control="0", ci=CUPED_CI):
+    """
+    由 cuped 矩在服务端计算：θ = 合并各组后的 Cov(y, x) / Var(x)，
+    调整后均值 = ȳ - θ·(x̄ - 全体 x̄)，方差 = Var(y) - 2θ·Cov(y, x) + θ²·Var(x)，与对照组的差值及正态近似区间。
+    """
+    z = NormalDist().inv_cdf(1 - (1 - ci) / 2)
+    names = ", ".join(f"'{name}'" for name in metric_names)
+    return f"""
+    WITH s AS (
+        SELECT metric, variation_id, n, sum_x, sum_x2, sum_y, sum_y2, sum_xy
+        FROM {stats_table}
+        WHERE grain = '{CUPED_GRAIN}' AND metric IN ({names}) AND n > 1
+    ),
+    pooled AS (
+        SELECT metric,
+               SUM(sum_y) / SUM(n) AS pre_mean_all,
+               (SUM(sum_xy) - SUM(sum_x) * SUM(sum_y) / SUM(n))
+                   / NULLIF(SUM(sum_y2) - SUM(sum_y) * SUM(sum_y) / SUM(n), 0) AS theta
+        FROM s
+        GROUP BY metric
+    ),
+    moments AS (
+        SELECT s.metric, s.variation_id, s.n,
+               s.sum_y / s.n AS pre_mean,
+               s.sum_x / s.n AS mean,
+               COALESCE(p.theta, 0) AS theta,
+               p.pre_mean_all,
+               (s.sum_x2 - s.sum_x * s.sum_x / s.n) / (s.n - 1) AS var_y,
+               (s.sum_y2 - s.sum_y * s.sum_y / s.n) / (s.n - 1) AS var_x,
+               (s.sum_xy - s.sum_x * s.sum_y / s.n) / (s.n - 1) AS cov_xy
+        FROM s
+        JOIN pooled p ON s.metric = p.metric
+    ),
+    v AS (
+        SELECT metric, variation_id, n, pre_mean, mean, theta,
+               mean - theta * (pre_mean - pre_mean_all) AS adjusted_mean,
+               var_y,
+               GREATEST(var_y - 2 * theta * cov_xy + theta * theta * var_x, 0) AS var_adj
+        FROM moments
+    )
+    SELECT
+        e.metric,
+        e.variation_id,
+        e.n,
+        e.pre_mean,
+        e.mean,
+        e.adjusted_mean,
+        e.theta,
+        CASE WHEN e.var_y > 0 THEN 1 - e.var_adj / e.var_y ELSE 0 END AS variance_reduction,
+        SQRT(e.var_y / e.n) AS se,
+        SQRT(e.var_adj / e.n) AS adjusted_se,
+        c.adjusted_mean AS control_adjusted_mean,
+        e.adjusted_mean - c.adjusted_mean AS diff,
+        CASE WHEN c.adjusted_mean != 0 THEN (e.adjusted_mean - c.adjusted_mean) / c.adjusted_mean ELSE 0 END AS uplift,
+        e.adjusted_mean - c.adjusted_mean - {z} * SQRT(e.var_adj / e.n + c.var_adj / c.n) AS ci_lower,
+        e.adjusted_mean - c.adjusted_mean + {z} * SQRT(e.var_adj / e.n + c.var_adj / c.n) AS ci_upper,
+        (e.adjusted_mean - c.adjusted_mean) / NULLIF(SQRT(e.var_adj / e.n + c.var_adj / c.n), 0) AS z_score,
+        '{experiment_tag}' AS experiment_tag
+    FROM v e
+    LEFT JOIN v c ON c.metric = e.metric AND c.variation_id = '{control}'
+    """
+
+
+def run_cuped(metrics, tag, assignment_table, first_day, last_day, experiment_start, pre_days=CUPED_PRE_DAYS):
+    """
+    写入 cuped 矩（统计量表）后在服务端生成 tbl_report_cuped_{tag}（INSERT OVERWRITE 原子替换）。
+    实验前窗口为 [experiment_start - pre_days, experiment_start - 1]。
+    """
+    experiment_start = as_date(experiment_start)
+    pre_start, pre_end = experiment_start - timedelta(days=pre_days), experiment_start - timedelta(days=1)
+    names = [m["name"] for m in metrics]
+    select_sql = compile_cuped_stats(metrics, assignment_table, first_day, last_day, pre_start, pre_end, tag)
+    with get_engine().connect() as conn:
+        conn.execute(text("SET query_timeout = 30000;"))
+        stats_table = prepare_stats(conn, tag, names, grains=(CUPED_GRAIN,))
+        conn.execute(text(f"INSERT INTO {stats_table} ({', '.join(STATS_COLUMNS)})\n{select_sql};"))
+        table_name = cuped_table_name(tag)
+        conn.execute(text(CUPED_TABLE_DDL.format(table=table_name)))
+    print(f"🧮 CUPED 矩已写入 {stats_table}：{len(names)} 个指标，实验前窗口 {pre_start} ~ {pre_end}")
+    compact_to_summary(table_name, CUPED_COLUMNS, cuped_report_query(stats_table, names, tag))
+    return table_name
@@ -0,0 +1,61 @@
+import os
+from datetime import date, datetime, timedelta
+
+# 区间模式：每条 INSERT…SELECT 覆盖的天数；<= 0 表示整个实验周期一条语句完成，1 等价于原来的逐日循环
+RANGE_CHUNK_DAYS = int(os.getenv("RANGE_CHUNK_DAYS", "7"))
+
+
+def as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def iter_date_chunks(first_day, last_day, chunk_days=None):
+    """
+    将闭区间 [first_day, last_day] 切成若干连续日期块，返回 (块起始日, 块结束日) 字符串。
+    同一块内的所有日期用一条按日期分组的语句计算，避免每天重复规划查询、重复扫描分流表。
+    """
+    first_day, last_day = as_date(first_day), as_date(last_day)
+    if chunk_days is None:
+        chunk_days = RANGE_CHUNK_DAYS
+    if chunk_days <= 0:
+        chunk_days = (last_day - first_day).days + 1
+
+    chunk_start = first_day
+    while chunk_start <= last_day:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), last_day)
+        yield chunk_start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")
+        chunk_start = chunk_end + timedelta(days=1)
+
+
+def dates_union_sql(chunk_start, chunk_end, column="event_date"):
+    """生成块内每一天一行的 SELECT … UNION ALL 子查询，用于补齐逐日模式下会出现的空日期行。"""
+    day, last_day = as_date(chunk_start), as_date(chunk_end)
+    rows = []
+    while day <= last_day:
+        rows.append(f"SELECT '{day.strftime('%Y-%m-%d')}' AS {column}")
+        day += timedelta(days=1)
+    return "\n                UNION ALL ".join(rows)
+
+
+def delete_date_range_sql(table_name, column, first_day, last_day, conditions=()):
+    """
+    删除闭区间 [first_day, last_day] 的 DELETE 语句。StarRocks 非主键表的 DELETE 条件只支持
+    =、>、<、>=、<=、!=、IN、NOT IN 并用 AND 连接，不支持 BETWEEN，所以区间写成 >= AND <=。
+    conditions：额外的 AND 条件（如 metric IN (...)）。
+    """
+    predicates = list(conditions) + [f"{column} >= '{as_date(first_day)}'", f"{column} <= '{as_date(last_day)}'"]
+    return f"DELETE FROM {table_name} WHERE {' AND '.join(predicates)};"
+
+
+if __name__ == "__main__":
+    # 自检：DELETE 不含 BETWEEN，区间两端都包含
+    sql = delete_date_range_sql("tbl_demo", "active_date", "2025-01-01", datetime(2025, 1, 7, 12), ["grain = 'daily'"])
+    print(sql)
+    assert "BETWEEN" not in sql.upper()
+    assert sql == ("DELETE FROM tbl_demo WHERE grain = 'daily' AND active_date >= '2025-01-01' "
+                   "AND active_date <= '2025-01-07';")
+    assert [c for c in iter_date_chunks("2025-01-01", "2025-01-10", 4)][-1] == ("2025-01-09", "2025-01-10")
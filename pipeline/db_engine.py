@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+
+load_dotenv()
+
+# ============= 连接池配置（可通过环境变量覆盖） =============
+DB_USER = os.getenv("DB_USER", "bigdata")
+DB_HOST = os.getenv("DB_HOST", "3.135.224.186")
+DB_PORT = int(os.getenv("DB_PORT", "9030"))
+DEFAULT_DATABASE = "flow_ab_test"
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))            # 常驻连接数
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "8"))      # 峰值时允许额外创建的连接数
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "300"))    # 等待空闲连接的最长秒数
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))   # 连接最长存活秒数，避免被 FE 主动断开
+
+_engines = {}
+_lock = threading.Lock()
+_stats = {
+    "engines_created": 0,
+    "checkouts": 0,
+    "connects": 0,
+    "connect_seconds": 0.0,
+}
+
+
+def _record(key, value=1):
+    with _lock:
+        _stats[key] += value
+
+
+def _build_url(database):
+    password = urllib.parse.quote_plus(os.environ['DB_PASSWORD'])
+    return f"mysql+pymysql://{DB_USER}:{password}@{DB_HOST}:{DB_PORT}/{database}?charset=utf8mb4"
+
+
+def _attach_counters(engine):
+    @event.listens_for(engine, "do_connect")
+    def _timed_connect(dialect, conn_rec, cargs, cparams):
+        # 接管 DBAPI 建连，统计每次冷启动 TCP/鉴权握手的耗时
+        dbapi = getattr(dialect, "loaded_dbapi", None) or dialect.dbapi
+        start = time.perf_counter()
+        dbapi_conn = dbapi.connect(*cargs, **cparams)
+        with _lock:
+            _stats["connects"] += 1
+            _stats["connect_seconds"] += time.perf_counter() - start
+        return dbapi_conn
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_conn, conn_rec, conn_proxy):
+        _record("checkouts")
+
+
+def get_engine(database=DEFAULT_DATABASE):
+    """
+    返回进程内共享的 StarRocks 引擎（按 database 懒加载，只创建一次）。
+    调用方不要 dispose 返回的引擎，连接归还由连接池负责。
+    """
+    engine = _engines.get(database)
+    if engine is not None:
+        return engine
+    with _lock:
+        engine = _engines.get(database)
+        if engine is None:
+            engine = create_engine(
+                _build_url(database),
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+                pool_timeout=POOL_TIMEOUT,
+                pool_recycle=POOL_RECYCLE,
+                pool_pre_ping=True,
+            )
+            _attach_counters(engine)
+            _engines[database] = engine
+            _stats["engines_created"] += 1
+            logging.info(f"✅ 共享数据库连接池已建立：{database}（pool_size={POOL_SIZE}, max_overflow={MAX_OVERFLOW}）")
+    return engine
+
+
+def get_db_connection():
+    """兼容各指标模块原有的 get_db_connection() 调用方式。"""
+    return get_engine()
+
+
+def get_pool_stats():
+    with _lock:
+        stats = dict(_stats)
+    connects = stats["connects"]
+    stats["avg_connect_ms"] = round(stats["connect_seconds"] / connects * 1000, 2) if connects else 0.0
+    # 每次 checkout 若都新建连接，需要的握手次数 = checkouts；池化后实际只握手 connects 次
+    stats["handshakes_saved"] = max(stats["checkouts"] - connects, 0)
+    stats["est_seconds_saved"] = round(stats["handshakes_saved"] * stats["avg_connect_ms"] / 1000, 2)
+    return stats
+
+
+def reset_pool_stats():
+    with _lock:
+        for key in _stats:
+            _stats[key] = 0.0 if key == "connect_seconds" else 0
+
+
+def log_pool_stats(tag=None):
+    stats = get_pool_stats()
+    prefix = f"标签 {tag} " if tag else ""
+    print(f"🔌 {prefix}连接池统计：checkout {stats['checkouts']} 次，新建连接 {stats['connects']} 次，"
+          f"平均握手 {stats['avg_connect_ms']} ms，节省握手 {stats['handshakes_saved']} 次"
+          f"（约 {stats['est_seconds_saved']} 秒）")
+    return stats
+
+
+def dispose_all():
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
@@ -0,0 +1,45 @@
+import os
+
+from sqlalchemy import text
+
+# ============= 估算模式 =============
+# 日内看板检查时用 approx_count_distinct（HyperLogLog）代替精确 COUNT(DISTINCT)，分钟级出数；
+# 默认精确模式，最终数字以精确模式为准。估算模式写出的行 is_approximate = 1，且不推进水位，
+# 下一次精确运行会重算这些日期并覆盖。
+APPROX_FLAG_COLUMN = "is_approximate"
+
+_estimate = os.getenv("ESTIMATE_MODE", "0") == "1"
+_flagged_tables = set()
+
+
+def set_estimate_mode(flag):
+    """main_run --estimate：本进程内去重用户数改用 HLL 估算。"""
+    global _estimate
+    _estimate = bool(flag)
+
+
+def is_estimate_mode():
+    return _estimate
+
+
+def count_distinct(expr):
+    """去重计数表达式：精确模式 COUNT(DISTINCT expr)，估算模式 approx_count_distinct(expr)（NULL 同样不计）。"""
+    return f"approx_count_distinct({expr})" if _estimate else f"COUNT(DISTINCT {expr})"
+
+
+def approx_flag_sql():
+    """写入 is_approximate 列的字面值。"""
+    return "1" if _estimate else "0"
+
+
+def ensure_approx_column(conn, table_name):
+    """已有报表缺少 is_approximate 列时补上（0 = 精确，1 = 估算），本进程每张表只检查一次。"""
+    if table_name in _flagged_tables:
+        return
+    columns = {str(row[0]).lower() for row in conn.execute(text(f"SHOW COLUMNS FROM {table_name};"))}
+    if APPROX_FLAG_COLUMN not in columns:
+        conn.execute(text(
+            f"ALTER TABLE {table_name} ADD COLUMN {APPROX_FLAG_COLUMN} TINYINT DEFAULT '0' COMMENT '1 = HLL 估算值';"
+        ))
+        print(f"🧩 表 {table_name} 已添加 {APPROX_FLAG_COLUMN} 列。")
+    _flagged_tables.add(table_name)
@@ -0,0 +1,333 @@
+from sqlalchemy import text
+
+from pipeline.date_range import iter_date_chunks
+from pipeline.db_engine import get_engine
+from pipeline.estimate import approx_flag_sql, count_distinct, is_estimate_mode
+from pipeline.report_writer import staged_table
+from pipeline.sufficient_stats import STATS_COLUMNS, prepare_stats, stats_union_sql
+
+# ============= 事件源登记 =============
+# 每个源只登记表名和数值列；同一条语句中一个源只扫描一次，所有引用它的指标共享
+SOURCES = {
+    "subscribe": {"table": "flow_event_info.tbl_app_event_subscribe", "value": "revenue"},
+    "currency_purchase": {"table": "flow_event_info.tbl_app_event_currency_purchase", "value": "revenue"},
+    "ads_impression": {"table": "flow_event_info.tbl_app_event_ads_impression", "value": "ad_revenue"},
+    "session": {"table": "flow_event_info.tbl_app_session_info", "value": "duration / 1000 / 60"},   # 使用时长（分钟）
+    "chat_send": {"table": "flow_event_info.tbl_app_event_chat_send", "value": None},
+}
+
+# 聚合口径：sum = 数值列求和，count = 事件数，users = 有事件的去重用户数
+TERM_KINDS = ("sum", "count", "users")
+# 粒度：daily 按事件日，cohort 按首次分流日，overall 整个实验周期一行（event_date 为空）
+GRAINS = ("daily", "cohort", "overall")
+GRAIN_KEYS = {
+    "daily": "f.event_date",
+    "cohort": "e.first_assigned_date",
+    "overall": "CAST(NULL AS DATE)",
+}
+
+REGISTRY_TABLE_DDL = """
+CREATE TABLE {table} (
+    event_date DATE,
+    variation_id VARCHAR(255),
+    grain VARCHAR(32),
+    metric VARCHAR(128),
+    numerator DOUBLE,
+    denominator DOUBLE,
+    value DOUBLE,
+    experiment_tag VARCHAR(255),
+    is_approximate TINYINT
+);
+"""
+REGISTRY_COLUMNS = ["event_date", "variation_id", "grain", "metric", "numerator", "denominator", "value", "experiment_tag",
+                    "is_approximate"]
+
+
+def _as_tuple(sources):
+    return (sources,) if isinstance(sources, str) else tuple(sources)
+
+
+def _term(spec, default_sources, filters):
+    if spec is None:
+        return None
+    kind, sources = (spec, default_sources) if isinstance(spec, str) else (spec[0], _as_tuple(spec[1]))
+    if kind not in TERM_KINDS:
+        raise ValueError(f"未知聚合口径 {kind}，可选：{TERM_KINDS}")
+    for source in sources:
+        if source not in SOURCES:
+            raise ValueError(f"未登记的事件源 {source}")
+        if kind == "sum" and SOURCES[source]["value"] is None:
+            raise ValueError(f"事件源 {source} 没有数值列，不能 sum")
+    return {"kind": kind, "sources": sources, "filters": filters}
+
+
+def metric(name, source, numerator, denominator=None, filters=None, grain="daily", precision=4):
+    """
+    声明一个指标：(事件源, 过滤条件, 分子, 分母, 粒度)。
+    - source：事件源名或列表（多个源的数值相加，如订阅 + 内购 + 广告收入）
+    - numerator / denominator：聚合口径 "sum" / "count" / "users"，
+      或 (口径, 事件源) 元组单独指定该项的事件源，如 ("users", "session")
+    - filters：作用在源表行上的 SQL 条件，编译为条件聚合，不会多扫一次源表
+    - denominator 为空时 value = numerator
+    """
+    if grain not in GRAINS:
+        raise ValueError(f"未知粒度 {grain}，可选：{GRAINS}")
+    sources = _as_tuple(source)
+    return {
+        "name": name,
+        "numerator": _term(numerator, sources, filters),
+        "denominator": _term(denominator, sources, filters),
+        "grain": grain,
+        "precision": precision,
+    }
+
+
+# ============= 编译：同粒度指标合并为一条语句 =============
+def measure_columns(metrics):
+    """收集所有 (事件源, 过滤条件) 组合，每个组合在源 CTE 中对应一对 _sum / _cnt 列。"""
+    measures = {}
+    for m in metrics:
+        for term in (m["numerator"], m["denominator"]):
+            if term is None:
+                continue
+            for source in term["sources"]:
+                key = (source, term["filters"])
+                if key not in measures:
+                    measures[key] = f"{source}_{sum(1 for s, _ in measures if s == source)}"
+    return measures
+
+
+def _term_sql(term, measures):
+    columns = [measures[(source, term["filters"])] for source in term["sources"]]
+    if term["kind"] == "sum":
+        return " + ".join(f"SUM(f.{c}_sum)" for c in columns)
+    if term["kind"] == "count":
+        return " + ".join(f"SUM(f.{c}_cnt)" for c in columns)
+    condition = " OR ".join(f"f.{c}_cnt > 0" for c in columns)
+    return count_distinct(f"CASE WHEN {condition} THEN f.user_id END")
+
+
+def _user_term_sql(term, measures):
+    """用户级取值：sum / count 为该用户的合计，users 为 0/1（该用户是否有事件）。"""
+    columns = [measures[(source, term["filters"])] for source in term["sources"]]
+    if term["kind"] == "sum":
+        return " + ".join(f"SUM(f.{c}_sum)" for c in columns)
+    counts = " + ".join(f"SUM(f.{c}_cnt)" for c in columns)
+    if term["kind"] == "count":
+        return counts
+    return f"CASE WHEN {counts} > 0 THEN 1 ELSE 0 END"
+
+
+def facts_sql(measures, start_day, end_day):
+    """每个事件源一个 CTE，按 (user_id, event_date) 预聚合出所有过滤条件下的 _sum / _cnt，再 UNION ALL 成 facts。"""
+    all_columns = list(measures.values())
+    source_ctes, fact_selects = [], []
+    for source in dict.fromkeys(s for s, _ in measures):
+        value = SOURCES[source]["value"]
+        aggregates = []
+        for (s, filters), column in measures.items():
+            if s != source:
+                continue
+            if filters:
+                value_sql = f"SUM(CASE WHEN {filters} THEN {value} ELSE 0 END)" if value else "0"
+                count_sql = f"SUM(CASE WHEN {filters} THEN 1 ELSE 0 END)"
+            else:
+                value_sql = f"SUM({value})" if value else "0"
+                count_sql = "COUNT(*)"
+            aggregates.append(f"{value_sql} AS {column}_sum")
+            aggregates.append(f"{count_sql} AS {column}_cnt")
+        source_ctes.append(f"""
+    src_{source} AS (
+        SELECT user_id, event_date,
+               {", ".join(aggregates)}
+        FROM {SOURCES[source]['table']}
+        WHERE event_date BETWEEN '{start_day}' AND '{end_day}'
+        GROUP BY user_id, event_date
+    )""")
+        own_columns = {c for (s, _), c in measures.items() if s == source}
+        projection = ", ".join(
+            f"{c}_sum, {c}_cnt" if c in own_columns else f"0 AS {c}_sum, 0 AS {c}_cnt"
+            for c in all_columns
+        )
+        fact_selects.append(f"SELECT user_id, event_date, {projection} FROM src_{source}")
+
+    union_facts = "\n        UNION ALL\n        ".join(fact_selects)
+    return f"""{",".join(source_ctes)},
+    facts AS (
+        {union_facts}
+    )"""
+
+
+def _single_grain(metrics):
+    grains = {m["grain"] for m in metrics}
+    if len(grains) != 1:
+        raise ValueError(f"只接受同一粒度的指标，当前为 {grains}")
+    return grains.pop()
+
+
+def compile_metrics(metrics, assignment_table, start_day, end_day, experiment_tag):
+    """
+    把同一粒度的一组指标编译成一条 SELECT（输出长表行）：
+    - 每个事件源一个 CTE，只扫描一次，按 (user_id, event_date) 预聚合出所有过滤条件下的 _sum / _cnt
+    - 各源 UNION ALL 后与首次分流表 JOIN 一次，所有分子 / 分母在同一个 GROUP BY 中算出
+    - 最后按指标展开为 (metric, numerator, denominator, value) 多行
+    """
+    grain = _single_grain(metrics)
+    measures = measure_columns(metrics)
+
+    grain_key = GRAIN_KEYS[grain]
+
+    agg_columns = []
+    for i, m in enumerate(metrics):
+        agg_columns.append(f"{_term_sql(m['numerator'], measures)} AS m{i}_num")
+        den = _term_sql(m["denominator"], measures) if m["denominator"] else "NULL"
+        agg_columns.append(f"{den} AS m{i}_den")
+
+    unions = []
+    for i, m in enumerate(metrics):
+        value = (f"ROUND(m{i}_num / NULLIF(m{i}_den, 0), {m['precision']})"
+                 if m["denominator"] else f"m{i}_num")
+        unions.append(f"""
+    SELECT grain_key AS event_date, variation_id, '{grain}' AS grain, '{m['name']}' AS metric,
+           m{i}_num AS numerator, m{i}_den AS denominator, {value} AS value,
+           '{experiment_tag}' AS experiment_tag, {approx_flag_sql()} AS is_approximate
+    FROM agg""")
+
+    agg_sql = ",\n            ".join(agg_columns)
+    union_sql = "\n    UNION ALL".join(unions)
+    return f"""
+    WITH{facts_sql(measures, start_day, end_day)},
+    agg AS (
+        SELECT
+            {grain_key} AS grain_key,
+            e.variation AS variation_id,
+            {agg_sql}
+        FROM facts f
+        JOIN {assignment_table} e
+          ON f.user_id = e.user_id
+         AND e.first_assigned_date <= f.event_date
+        GROUP BY {grain_key}, e.variation
+    )
+    {union_sql}
+    """
+
+
+def compile_stats(metrics, assignment_table, start_day, end_day, experiment_tag):
+    """
+    同一粒度的一组指标编译成充分统计量 SELECT（pipeline.sufficient_stats 约定的列）：
+    先按 (粒度日期, 分组, 用户) 聚合出每个指标的用户级 x（分子）/ y（分母），再汇总 n、Σx、Σx²、Σy、Σy²、Σxy。
+    用户只要有该指标涉及的任一事件即计入 n。
+    """
+    grain = _single_grain(metrics)
+    measures = measure_columns(metrics)
+    grain_key = GRAIN_KEYS[grain]
+
+    unit_columns, stats_metrics = [], []
+    for i, m in enumerate(metrics):
+        terms = [t for t in (m["numerator"], m["denominator"]) if t is not None]
+        involved = dict.fromkeys(measures[(source, t["filters"])] for t in terms for source in t["sources"])
+        present = " + ".join(f"SUM(f.{c}_cnt)" for c in involved)
+        unit_columns.append(f"{_user_term_sql(m['numerator'], measures)} AS m{i}_x")
+        if m["denominator"]:
+            unit_columns.append(f"{_user_term_sql(m['denominator'], measures)} AS m{i}_y")
+        unit_columns.append(f"CASE WHEN {present} > 0 THEN 1 ELSE 0 END AS m{i}_n")
+        stats_metrics.append((m["name"], f"m{i}_x", f"m{i}_y" if m["denominator"] else None, f"m{i}_n = 1"))
+
+    unit_sql = ",\n            ".join(unit_columns)
+    return f"""
+    WITH{facts_sql(measures, start_day, end_day)},
+    units AS (
+        SELECT
+            {grain_key} AS event_date,
+            e.variation AS variation_id,
+            f.user_id,
+            {unit_sql}
+        FROM facts f
+        JOIN {assignment_table} e
+          ON f.user_id = e.user_id
+         AND e.first_assigned_date <= f.event_date
+        GROUP BY {grain_key}, e.variation, f.user_id
+    )
+    {stats_union_sql(stats_metrics, experiment_tag, grain)}
+    """
+
+
+def metrics_from_stats(metrics, stats_table, grain):
+    """由充分统计量派生长表行：numerator = Σx，denominator = Σy，value = Σx / Σy（非比率指标为 Σx）。"""
+    names = ", ".join(f"'{m['name']}'" for m in metrics)
+    value_cases = "\n            ".join(
+        f"WHEN '{m['name']}' THEN ROUND(sum_x / NULLIF(sum_y, 0), {m['precision']})"
+        for m in metrics if m["denominator"]
+    )
+    value_sql = f"CASE metric\n            {value_cases}\n            ELSE sum_x END" if value_cases else "sum_x"
+    return f"""
+    SELECT event_date, variation_id, grain, metric,
+           sum_x AS numerator, sum_y AS denominator,
+           {value_sql} AS value,
+           experiment_tag, 0 AS is_approximate
+    FROM {stats_table}
+    WHERE grain = '{grain}' AND metric IN ({names})
+    """
+
+
+def run_metrics(metrics, table_name, assignment_table, first_day, last_day, experiment_tag, chunk_days=None):
+    """
+    在 staging 表中按粒度编译执行全部指标，成功后原子发布长表 table_name。
+    daily 粒度按日期块切分；cohort / overall 需要整段数据，一条语句覆盖整个区间。
+    精确模式下先写充分统计量表（每块扫描一次），长表行再由统计量派生，不再单独扫描事件表；
+    估算模式（--estimate）直接编译 HLL 去重的长表，不写统计量。
+    """
+    by_grain = {}
+    for m in metrics:
+        by_grain.setdefault(m["grain"], []).append(m)
+    with_stats = not is_estimate_mode()
+
+    failed = []
+    with staged_table(table_name, REGISTRY_TABLE_DDL) as staging, get_engine().connect() as conn:
+        conn.execute(text("SET query_timeout = 30000;"))
+        if with_stats:
+            stats_table = prepare_stats(conn, experiment_tag, [m["name"] for m in metrics], grains=tuple(by_grain))
+        for grain, grain_metrics in by_grain.items():
+            ranges = iter_date_chunks(first_day, last_day, chunk_days) if grain == "daily" else [(first_day, last_day)]
+            for chunk_start, chunk_end in ranges:
+                print(f"👉 {grain} 粒度 {len(grain_metrics)} 个指标：{chunk_start} ~ {chunk_end}")
+                if with_stats:
+                    select_sql = compile_stats(grain_metrics, assignment_table, chunk_start, chunk_end, experiment_tag)
+                    insert_sql = f"INSERT INTO {stats_table} ({', '.join(STATS_COLUMNS)})\n{select_sql};"
+                else:
+                    select_sql = compile_metrics(grain_metrics, assignment_table, chunk_start, chunk_end, experiment_tag)
+                    insert_sql = f"INSERT INTO {staging} ({', '.join(REGISTRY_COLUMNS)})\n{select_sql};"
+                try:
+                    conn.execute(text(insert_sql))
+                except Exception as e:
+                    print(f"❌ {grain} 粒度 {chunk_start} ~ {chunk_end} 失败：{e}")
+                    print(f"🔍 SQL:\n{insert_sql}")
+                    failed.append((grain, chunk_start, chunk_end))
+            if with_stats:
+                conn.execute(text(f"INSERT INTO {staging} ({', '.join(REGISTRY_COLUMNS)})\n"
+                                  f"{metrics_from_stats(grain_metrics, stats_table, grain)};"))
+        if failed:
+            raise RuntimeError(f"{len(failed)} 条指标语句失败，保留正式表 {table_name} 上一版数据：{failed}")
+
+
+def pivot_query(table_name, columns, grain="daily", with_tag=True, with_flag=False):
+    """
+    长表 → 宽表的 SELECT，用于从指标长表派生原有的单指标报表。
+    columns：[(输出列, 指标名, 字段)]，字段为 numerator / denominator / value。
+    with_flag：同时输出 is_approximate（估算模式写出的行为 1）。
+    """
+    select_columns = [f"MAX(CASE WHEN metric = '{name}' THEN {field} END) AS {out}" for out, name, field in columns]
+    if with_tag:
+        select_columns.append("MAX(experiment_tag) AS experiment_tag")
+    if with_flag:
+        select_columns.append("MAX(is_approximate) AS is_approximate")
+    select_sql = ",\n        ".join(select_columns)
+    return f"""
+    SELECT
+        event_date,
+        variation_id,
+        {select_sql}
+    FROM {table_name}
+    WHERE grain = '{grain}'
+    GROUP BY event_date, variation_id
+    """
@@ -0,0 +1,211 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from pipeline.db_engine import get_engine
+
+# ============= 语句级埋点配置 =============
+# 通过 SQLAlchemy 游标事件记录每条语句：标签、任务、日期 / 分批、耗时、影响行数、StarRocks query_id、错误。
+# 记录先缓存在进程内，每个任务结束时批量写入本地 JSONL 和 tbl_pipeline_run_log，运行结束打印最慢的 N 条语句。
+RUN_LOG_TABLE = "flow_ab_test.tbl_pipeline_run_log"
+QUERY_LOG_DIR = os.getenv("QUERY_LOG_DIR", os.path.join(".cache", "query_log"))
+QUERY_LOG_TOP_N = int(os.getenv("QUERY_LOG_TOP_N", "10"))
+QUERY_LOG_SQL_CHARS = int(os.getenv("QUERY_LOG_SQL_CHARS", "2000"))     # 写入日志的 SQL 截断长度
+QUERY_LOG_QUERY_ID = os.getenv("QUERY_LOG_QUERY_ID", "1") == "1"        # 每条语句后追加一次 SELECT last_query_id()
+
+RUN_LOG_COLUMNS = ["run_id", "experiment_tag", "module", "unit", "statement_type", "statement",
+                   "elapsed_ms", "row_count", "query_id", "error", "started_at"]
+
+RUN_LOG_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {RUN_LOG_TABLE} (
+    run_id VARCHAR(64) NOT NULL COMMENT '一次 main_run 的编号',
+    experiment_tag VARCHAR(255),
+    module VARCHAR(255) COMMENT '调度任务名',
+    unit VARCHAR(255) COMMENT '日期 / 分批等执行单元',
+    statement_type VARCHAR(32),
+    statement STRING,
+    elapsed_ms DOUBLE,
+    row_count BIGINT,
+    query_id VARCHAR(64) COMMENT '可在 FE 上按 query_id 查看 Profile',
+    error STRING,
+    started_at DATETIME
+) ENGINE=OLAP
+DUPLICATE KEY(run_id)
+DISTRIBUTED BY HASH(run_id) BUCKETS 4
+PROPERTIES ("replication_num" = "3");
+"""
+
+_scope = contextvars.ContextVar("query_scope", default={})
+_lock = threading.Lock()
+_state = {"run_id": None, "tag": None, "installed": False, "table_ready": False}
+_pending = []   # 尚未落盘 / 入库的记录
+_records = []   # 本次运行的全部记录，用于汇总
+
+
+@contextmanager
+def query_scope(**fields):
+    """为当前线程（及 copy_context 派生的任务）内执行的语句附加上下文，如 module=任务名、unit=日期或分批。"""
+    token = _scope.set({**_scope.get(), **{k: str(v) for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _fetch_query_id(conn):
+    # 另开游标读取，不影响本条语句尚未取走的结果集（pymysql 默认游标已整体缓冲）
+    # conn 可以是 SQLAlchemy Connection，也可以是 raw_connection() 取得的 DBAPI 连接
+    try:
+        cursor = getattr(conn, "connection", conn).cursor()
+        try:
+            cursor.execute("SELECT last_query_id()")
+            row = cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            cursor.close()
+    except Exception:
+        return None
+
+
+def _enabled(conn):
+    return _state["installed"] and conn is not None and conn.get_execution_options().get("query_log", True)
+
+
+def _append(conn, statement, elapsed, row_count, error=None):
+    scope = _scope.get()
+    record = {
+        "run_id": _state["run_id"],
+        "experiment_tag": scope.get("tag", _state["tag"]),
+        "module": scope.get("module", ""),
+        "unit": scope.get("unit", ""),
+        "statement_type": (statement.split(None, 1) or [""])[0].upper()[:32],
+        "statement": statement.strip()[:QUERY_LOG_SQL_CHARS],
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "row_count": row_count,
+        "query_id": _fetch_query_id(conn) if QUERY_LOG_QUERY_ID else None,
+        "error": error and str(error)[:QUERY_LOG_SQL_CHARS],
+        "started_at": datetime.fromtimestamp(time.time() - elapsed).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with _lock:
+        _pending.append(record)
+        _records.append(record)
+
+
+@contextmanager
+def logged_statement(statement, conn=None):
+    """
+    不经过 SQLAlchemy 游标事件的语句（raw 连接上的流式游标、Arrow Flight）手动计入埋点。
+    with 块内把行数写入 yield 的 dict["row_count"]；退出前应已取完结果集并关闭游标，
+    conn（DBAPI 连接）用于读取 last_query_id，为空时不记录 query_id。
+    """
+    result = {"row_count": None}
+    if not _state["installed"]:
+        yield result
+        return
+    started = time.perf_counter()
+    try:
+        yield result
+    except Exception as e:
+        _append(None, statement, time.perf_counter() - started, None, e)
+        raise
+    _append(conn, statement, time.perf_counter() - started, result["row_count"])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _enabled(conn):
+        conn.info.setdefault("query_log_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_log_started")
+    if _enabled(conn) and started:
+        elapsed = time.perf_counter() - started.pop()
+        row_count = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        _append(conn, statement, elapsed, row_count)
+
+
+def _handle_error(context):
+    conn = context.connection
+    started = conn.info.get("query_log_started") if conn is not None else None
+    if _enabled(conn) and started and context.statement:
+        elapsed = time.perf_counter() - started.pop()
+        # 连接已断开时不再追加 last_query_id 查询
+        _append(conn if not context.is_disconnect else None, context.statement, elapsed, None,
+                context.original_exception)
+
+
+def enable_query_log(tag, run_id=None):
+    """在 main_run 开头调用：为进程内所有引擎挂上语句埋点，返回本次 run_id。"""
+    with _lock:
+        _state["run_id"] = run_id or f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        _state["tag"] = tag
+        if not _state["installed"]:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Engine, "handle_error", _handle_error)
+            _state["installed"] = True
+    print(f"📝 语句埋点已开启：run_id={_state['run_id']}，日志目录 {QUERY_LOG_DIR}")
+    return _state["run_id"]
+
+
+def _log_path():
+    return os.path.join(QUERY_LOG_DIR, f"{_state['run_id']}.jsonl")
+
+
+def flush_query_log():
+    """把缓存的记录追加到本地 JSONL 并批量写入 tbl_pipeline_run_log；入库失败只提示，JSONL 中仍有完整记录。"""
+    with _lock:
+        batch = list(_pending)
+        _pending.clear()
+    if not batch:
+        return 0
+    os.makedirs(QUERY_LOG_DIR, exist_ok=True)
+    with _lock, open(_log_path(), "a", encoding="utf-8") as f:
+        for record in batch:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    try:
+        with get_engine().connect() as conn:
+            # 写日志本身的语句不计入埋点
+            conn = conn.execution_options(query_log=False)
+            if not _state["table_ready"]:
+                conn.execute(text(RUN_LOG_TABLE_DDL))
+                _state["table_ready"] = True
+            columns = ", ".join(RUN_LOG_COLUMNS)
+            params = ", ".join(f":{c}" for c in RUN_LOG_COLUMNS)
+            conn.execute(text(f"INSERT INTO {RUN_LOG_TABLE} ({columns}) VALUES ({params})"), batch)
+    except Exception as e:
+        print(f"⚠️ 语句日志写入 {RUN_LOG_TABLE} 失败（已保存在 {_log_path()}）：{e}")
+    return len(batch)
+
+
+def get_query_records():
+    with _lock:
+        return list(_records)
+
+
+def print_slowest_queries(top_n=QUERY_LOG_TOP_N):
+    """运行结束时调用：写出剩余记录，打印最慢的 top_n 条语句（可用 query_id 在 FE 上查看 Profile）。"""
+    flush_query_log()
+    records = get_query_records()
+    if not records:
+        return []
+    slowest = sorted(records, key=lambda r: r["elapsed_ms"], reverse=True)[:top_n]
+    failed = sum(1 for r in records if r["error"])
+    total_seconds = round(sum(r["elapsed_ms"] for r in records) / 1000, 2)
+    print(f"\n🐢 【最慢语句 Top {len(slowest)}】run_id={_state['run_id']}，共 {len(records)} 条语句，"
+          f"累计 {total_seconds} 秒，失败 {failed} 条")
+    for r in slowest:
+        icon = "❌" if r["error"] else "⏱️"
+        sql = " ".join(r["statement"].split())[:80]
+        location = " ".join(part for part in (r["module"], r["unit"]) if part)
+        print(f"{icon} {round(r['elapsed_ms'] / 1000, 2):>8} 秒  行数 {r['row_count']}  {location}  "
+              f"query_id={r['query_id']}  {sql}")
+    return slowest
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from pipeline.db_engine import get_engine
+
+STAGING_SUFFIX = "__staging"
+
+
+def staging_table_name(table_name):
+    return f"{table_name}{STAGING_SUFFIX}"
+
+
+def _split_name(table_name):
+    if "." in table_name:
+        return table_name.split(".", 1)
+    return None, table_name
+
+
+def _table_exists(conn, table_name):
+    database, name = _split_name(table_name)
+    query = f"SHOW TABLES FROM {database} LIKE '{name}'" if database else f"SHOW TABLES LIKE '{name}'"
+    return conn.execute(text(query)).fetchone() is not None
+
+
+def publish_staging(table_name, staging=None):
+    """
+    把 staging 表原子发布为正式表：
+    - 正式表已存在：ALTER TABLE ... SWAP WITH，一次元数据操作完成替换，随后删除换下来的旧数据
+    - 正式表不存在：直接把 staging 重命名为正式表
+    """
+    staging = staging or staging_table_name(table_name)
+    with get_engine().connect() as conn:
+        if _table_exists(conn, table_name):
+            conn.execute(text(f"ALTER TABLE {table_name} SWAP WITH {_split_name(staging)[1]};"))
+            conn.execute(text(f"DROP TABLE IF EXISTS {staging};"))
+        else:
+            conn.execute(text(f"ALTER TABLE {staging} RENAME {_split_name(table_name)[1]};"))
+    print(f"✅ 表 {table_name} 已通过 staging 原子发布。")
+
+
+@contextmanager
+def staged_table(table_name, create_table_query=None, carry_over_where=None, resume=False):
+    """
+    在 staging 表中重建报告表，成功后原子替换正式表；期间看板仍读取上一版完整数据。
+    - create_table_query：建表语句模板，表名位置写 {table}；为空时按正式表结构 CREATE TABLE LIKE
+    - carry_over_where：增量刷新时先把正式表中满足条件的旧行（如未变化的历史日期）复制进 staging
+    - with 块内抛出异常时不发布，正式表保持不变，staging 保留以便排查，重跑时会被重建
+    - resume=True 且 staging 已存在：沿用上次失败留下的 staging，只补写失败的单元
+    """
+    staging = staging_table_name(table_name)
+    with get_engine().connect() as conn:
+        conn.execute(text("SET query_timeout = 30000;"))
+        if resume and _table_exists(conn, staging):
+            print(f"♻️ 沿用已有 staging 表 {staging} 续跑。")
+        else:
+            conn.execute(text(f"DROP TABLE IF EXISTS {staging};"))
+            if create_table_query:
+                conn.execute(text(create_table_query.format(table=staging)))
+            else:
+                conn.execute(text(f"CREATE TABLE {staging} LIKE {table_name};"))
+            if carry_over_where and _table_exists(conn, table_name):
+                conn.execute(text(f"INSERT INTO {staging} SELECT * FROM {table_name} WHERE {carry_over_where};"))
+            print(f"🧱 staging 表 {staging} 已就绪，开始写入。")
+    yield staging
+    publish_staging(table_name, staging)
@@ -0,0 +1,211 @@
+import threading
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+from pipeline.assignment import window_assignment_sql
+from pipeline.date_range import as_date, delete_date_range_sql
+from pipeline.db_engine import get_engine
+from pipeline.watermark import LATE_ARRIVAL_DAYS, is_full_refresh
+
+# ============= BITMAP 留存引擎配置 =============
+# user_id 是字符串，先通过字典表编码成 BIGINT 再放进 BITMAP（精确计数，不用哈希）
+USER_DICT_TABLE = "flow_ab_test.tbl_user_id_dict"
+ACTIVE_BITMAP_TABLE = "flow_ab_test.tbl_bitmap_active_user_daily"   # 每个活跃日一个用户 BITMAP，各实验共用
+ACTIVE_SOURCE_TABLE = "flow_wide_info.tbl_wide_active_user_app_info"
+FIRST_VISIT_SOURCE_TABLE = "flow_wide_info.tbl_wide_user_first_visit_app_info"
+
+# 宽表输出的留存天数；增加 d30 / d60 只需在这里加天数（宽表加对应列），不会多扫一次明细
+RETENTION_DAYS = (1, 3, 7, 15)
+
+# cohort 定义：new = 首次访问日，active = 活跃日
+COHORT_TYPES = ("new", "active")
+
+_refresh_lock = threading.RLock()   # 字典编码串行执行，避免并发任务给同一用户分配两个编号
+_prepared = []                     # 本进程已刷新过的 (起始日, 结束日)
+
+_ACTIVE_FILTER = "keep_alive_flag = 1 AND user_id IS NOT NULL AND user_id != ''"
+
+
+def cohort_table_name(tag):
+    return f"flow_ab_test.tbl_bitmap_cohort_{tag}"
+
+
+def _ensure_tables(conn):
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS {USER_DICT_TABLE} (
+        user_id VARCHAR(255) NOT NULL,
+        uid BIGINT NOT NULL AUTO_INCREMENT
+    ) ENGINE=OLAP
+    PRIMARY KEY(user_id)
+    DISTRIBUTED BY HASH(user_id) BUCKETS 10
+    PROPERTIES ("replication_num" = "3");
+    """))
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS {ACTIVE_BITMAP_TABLE} (
+        active_date DATE NOT NULL,
+        users BITMAP BITMAP_UNION
+    ) ENGINE=OLAP
+    AGGREGATE KEY(active_date)
+    DISTRIBUTED BY HASH(active_date) BUCKETS 4
+    PROPERTIES ("replication_num" = "3");
+    """))
+
+
+def _active_users_query(first_day, last_day):
+    return f"""
+            SELECT DISTINCT user_id, active_date AS dt
+            FROM {ACTIVE_SOURCE_TABLE}
+            WHERE active_date BETWEEN '{first_day}' AND '{last_day}'
+              AND {_ACTIVE_FILTER}
+        """
+
+
+def _encode_users(conn, source_query):
+    """给 source_query 中新出现的用户分配编号；已有用户编号不变，历史 BITMAP 仍然有效。"""
+    with _refresh_lock:
+        conn.execute(text(f"""
+        INSERT INTO {USER_DICT_TABLE} (user_id)
+        SELECT s.user_id
+        FROM (SELECT DISTINCT user_id FROM ({source_query}) q) s
+        LEFT ANTI JOIN {USER_DICT_TABLE} d ON s.user_id = d.user_id;
+        """))
+
+
+def prepare_active_bitmaps(first_day, last_day):
+    """
+    编码区间内的用户并物化每个活跃日的用户 BITMAP。
+    已物化的日期只重算缺失的日期和最近 LATE_ARRIVAL_DAYS 天（迟到数据）；--full-refresh 时整段重算。
+    """
+    first_day = as_date(first_day)
+    last_day = min(as_date(last_day), date.today())
+    if first_day > last_day:
+        return
+    with _refresh_lock:
+        if any(lo <= first_day and last_day <= hi for lo, hi in _prepared):
+            return
+        with get_engine().connect() as conn:
+            conn.execute(text("SET query_timeout = 30000;"))
+            _ensure_tables(conn)
+
+            refresh_from = first_day
+            if not is_full_refresh():
+                existing = {as_date(row[0]) for row in conn.execute(text(f"""
+                    SELECT DISTINCT active_date FROM {ACTIVE_BITMAP_TABLE}
+                    WHERE active_date BETWEEN '{first_day}' AND '{last_day}'
+                """))}
+                missing = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)
+                           if first_day + timedelta(days=i) not in existing]
+                refresh_from = min(missing + [max(first_day, date.today() - timedelta(days=LATE_ARRIVAL_DAYS))])
+
+            if refresh_from <= last_day:
+                print(f"🧮 物化活跃用户 BITMAP：{refresh_from} ~ {last_day}")
+                active_query = _active_users_query(refresh_from, last_day)
+                _encode_users(conn, active_query)
+                # AGGREGATE KEY 表的 DELETE 不支持 BETWEEN
+                conn.execute(text(delete_date_range_sql(ACTIVE_BITMAP_TABLE, "active_date", refresh_from, last_day)))
+                conn.execute(text(f"""
+                INSERT INTO {ACTIVE_BITMAP_TABLE} (active_date, users)
+                SELECT a.dt, bitmap_union(to_bitmap(d.uid))
+                FROM ({active_query}) a
+                JOIN {USER_DICT_TABLE} d ON a.user_id = d.user_id
+                GROUP BY a.dt;
+                """))
+            else:
+                print(f"✅ 活跃用户 BITMAP 已是最新：{first_day} ~ {last_day}")
+        _prepared.append((first_day, last_day))
+
+
+def refresh_cohort_bitmaps(tag, cohort_type, experiment_name, cohort_start, cohort_end,
+                           assign_start, assign_end, incremental):
+    """
+    物化每个 (cohort 日期, 分组) 的用户 BITMAP：
+    - new：cohort 日期内首次访问、且在实验期内被分流的用户
+    - active：cohort 日期当天活跃、且在实验期内被分流的用户
+    分组取用户在 [assign_start, assign_end] 内的首次分流（window_assignment_sql），与原宽表口径一致。
+    增量时只重建 cohort_start 之后的 cohort，全量时重建该类型的全部 cohort。
+    """
+    if cohort_type not in COHORT_TYPES:
+        raise ValueError(f"未知 cohort 类型 {cohort_type}，可选：{COHORT_TYPES}")
+    cohort_start, cohort_end = as_date(cohort_start), as_date(cohort_end)
+    table_name = cohort_table_name(tag)
+
+    if cohort_type == "new":
+        base_query = f"""
+            SELECT user_id, DATE(first_visit_date) AS dt
+            FROM {FIRST_VISIT_SOURCE_TABLE}
+            -- 与原宽表口径一致：上界为日期（当天 00:00:00），不延伸到当天结束
+            WHERE first_visit_date BETWEEN '{cohort_start}' AND '{cohort_end}'
+              AND user_id IS NOT NULL AND user_id != ''
+        """
+    else:
+        base_query = _active_users_query(cohort_start, cohort_end)
+
+    with get_engine().connect() as conn:
+        conn.execute(text("SET query_timeout = 30000;"))
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            cohort_type VARCHAR(16) NOT NULL,
+            dt DATE NOT NULL,
+            variation VARCHAR(255) NOT NULL,
+            users BITMAP BITMAP_UNION
+        ) ENGINE=OLAP
+        AGGREGATE KEY(cohort_type, dt, variation)
+        DISTRIBUTED BY HASH(dt) BUCKETS 4
+        PROPERTIES ("replication_num" = "3");
+        """))
+        _ensure_tables(conn)
+        _encode_users(conn, base_query)
+        date_filter = f" AND dt >= '{cohort_start}'" if incremental else ""
+        conn.execute(text(f"DELETE FROM {table_name} WHERE cohort_type = '{cohort_type}'{date_filter};"))
+        conn.execute(text(f"""
+        INSERT INTO {table_name} (cohort_type, dt, variation, users)
+        SELECT '{cohort_type}', b.dt, e.variation, bitmap_union(to_bitmap(d.uid))
+        FROM ({base_query}) b
+        JOIN {USER_DICT_TABLE} d ON b.user_id = d.user_id
+        JOIN ({window_assignment_sql(experiment_name, assign_start, assign_end)}) e ON b.user_id = e.user_id
+        GROUP BY b.dt, e.variation;
+        """))
+    print(f"✅ cohort BITMAP 已刷新：{table_name} ({cohort_type}) {cohort_start} ~ {cohort_end}")
+
+
+def retention_query(tag, cohort_type, assignment_table, cohort_start, active_until, days=RETENTION_DAYS):
+    """
+    生成宽表 SELECT：(dt, variation, new_users, d{N}..., total_assigned)。
+    dN = bitmap_count(bitmap_and(cohort, 第 dt + N 天的活跃 BITMAP))，每个留存天只是按日期多关联一行 BITMAP；
+    active_until 之后的活跃不计入（与原口径的活跃窗口一致）。
+    """
+    joins, columns = [], []
+    for n in days:
+        joins.append(f"LEFT JOIN a a{n} ON a{n}.active_date = DATE_ADD(c.dt, INTERVAL {n} DAY)")
+        columns.append(f"COALESCE(bitmap_count(bitmap_and(c.users, a{n}.users)), 0) AS d{n}")
+    join_sql = "\n    ".join(joins)
+    column_sql = ",\n        ".join(columns)
+    return f"""
+    WITH c AS (
+        SELECT dt, variation, bitmap_union(users) AS users
+        FROM {cohort_table_name(tag)}
+        WHERE cohort_type = '{cohort_type}' AND dt >= '{as_date(cohort_start)}'
+        GROUP BY dt, variation
+    ),
+    a AS (
+        SELECT active_date, bitmap_union(users) AS users
+        FROM {ACTIVE_BITMAP_TABLE}
+        WHERE active_date BETWEEN DATE_ADD('{as_date(cohort_start)}', INTERVAL 1 DAY) AND '{as_date(active_until)}'
+        GROUP BY active_date
+    ),
+    ta AS (
+        SELECT first_assigned_date AS assign_date, variation, COUNT(user_id) AS total_assigned
+        FROM {assignment_table}
+        GROUP BY first_assigned_date, variation
+    )
+    SELECT
+        c.dt,
+        c.variation,
+        bitmap_count(c.users) AS new_users,
+        {column_sql},
+        COALESCE(ta.total_assigned, 0) AS total_assigned
+    FROM c
+    {join_sql}
+    LEFT JOIN ta ON ta.assign_date = c.dt AND ta.variation = c.variation
+    """
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pipeline.query_log import flush_query_log, query_scope
+
+# ============= 并发预算配置 =============
+DEFAULT_CLUSTER = "starrocks"
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("STARROCKS_MAX_CONCURRENCY", "4"))  # 每个集群同时执行的指标任务上限
+
+_semaphores = {}
+_semaphore_lock = threading.Lock()
+
+
+def get_cluster_semaphore(cluster=DEFAULT_CLUSTER, max_concurrency=None):
+    """同一进程内、同一集群共享一个并发信号量，多个编排器同时运行也不会超出预算。"""
+    with _semaphore_lock:
+        if cluster not in _semaphores:
+            _semaphores[cluster] = threading.BoundedSemaphore(max_concurrency or DEFAULT_MAX_CONCURRENCY)
+        return _semaphores[cluster]
+
+
+def job(name, func, deps=(), explanation=None, cluster=DEFAULT_CLUSTER):
+    """声明一个指标任务：func(tag) 在 deps 中所有任务成功后执行。"""
+    return {
+        "name": name,
+        "func": func,
+        "deps": tuple(deps),
+        "explanation": explanation,
+        "cluster": cluster,
+    }
+
+
+def _run_job(item, tag, semaphore, ready_at):
+    name = item["name"]
+    with semaphore:
+        started_at = time.time()
+        queue_wait = started_at - ready_at
+        print(f"\n🚀 开始执行 {name}，标签：{tag}（排队 {round(queue_wait, 2)} 秒）")
+        if item["explanation"]:
+            print(f"【说明】{item['explanation']}")
+        status, error = "success", None
+        try:
+            # 任务内执行的语句在埋点中记为该任务
+            with query_scope(tag=tag, module=name):
+                item["func"](tag)
+            print(f"✅ {name} 执行完成，耗时：{round(time.time() - started_at, 2)}秒")
+        except Exception as e:
+            status, error = "failed", str(e)
+            print(f"❌ {name} 执行失败，错误信息：{e}")
+    flush_query_log()
+    return {
+        "name": name,
+        "status": status,
+        "queue_wait": round(queue_wait, 2),
+        "wall_time": round(time.time() - started_at, 2),
+        "error": error,
+    }
+
+
+def _validate(jobs):
+    names = [item["name"] for item in jobs]
+    duplicated = {n for n in names if names.count(n) > 1}
+    if duplicated:
+        raise ValueError(f"任务名称重复：{sorted(duplicated)}")
+    for item in jobs:
+        unknown = [d for d in item["deps"] if d not in names]
+        if unknown:
+            raise ValueError(f"任务 {item['name']} 依赖了不存在的任务：{unknown}")
+
+
+def run_dag(jobs, tag, max_concurrency=None):
+    """
+    按依赖关系并发执行指标任务，返回每个任务的状态、排队时间和执行耗时。
+    - 无依赖关系的任务并发执行，同一集群同时执行的任务数不超过 max_concurrency
+    - 依赖失败或被跳过的任务会被跳过，不会在不完整的数据上继续计算
+    """
+    _validate(jobs)
+    workers = max_concurrency or DEFAULT_MAX_CONCURRENCY
+    pending = {item["name"]: item for item in jobs}
+    running = {}
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            progressed = True
+            while progressed:
+                progressed = False
+                for name, item in list(pending.items()):
+                    if any(d not in results for d in item["deps"]):
+                        continue
+                    del pending[name]
+                    progressed = True
+                    failed_deps = [d for d in item["deps"] if results[d]["status"] != "success"]
+                    if failed_deps:
+                        print(f"⏭️ {name} 已跳过，依赖任务未成功：{failed_deps}")
+                        results[name] = {"name": name, "status": "skipped", "queue_wait": 0.0,
+                                         "wall_time": 0.0, "error": f"依赖失败：{failed_deps}"}
+                        continue
+                    semaphore = get_cluster_semaphore(item["cluster"], max_concurrency)
+                    future = pool.submit(_run_job, item, tag, semaphore, time.time())
+                    running[future] = name
+
+            if not running:
+                if pending:
+                    raise ValueError(f"任务依赖存在环：{sorted(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    ordered = [results[item["name"]] for item in jobs]
+    print_run_summary(ordered, tag)
+    return ordered
+
+
+def print_run_summary(results, tag):
+    print(f"\n📋 【任务执行汇总】标签：{tag}")
+    for r in sorted(results, key=lambda r: r["wall_time"], reverse=True):
+        icon = {"success": "✅", "failed": "❌", "skipped": "⏭️"}[r["status"]]
+        print(f"{icon} {r['name']:<28} 耗时 {r['wall_time']:>8} 秒  排队 {r['queue_wait']:>8} 秒")
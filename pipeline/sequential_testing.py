@@ -0,0 +1,251 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from analysis.moment_stats import moments
+from analysis.msprt import MSPRT_ALPHA, mixing_variance, msprt_interval, msprt_p_value, running_update
+from pipeline.arrow_fetch import fetch_df
+from pipeline.date_range import as_date
+from pipeline.db_engine import get_engine
+from pipeline.estimate import is_estimate_mode
+from pipeline.retention_bitmap import RETENTION_DAYS
+from pipeline.stream_load import stream_load
+from pipeline.sufficient_stats import stats_table_name
+from pipeline.watermark import LATE_ARRIVAL_DAYS, is_full_refresh
+
+# ============= 序贯检验状态 =============
+# 每个 (tag, metric, variation) 保存截至 last_date 的累计 n / Σx / Σx² / Σy / Σy² / Σxy，
+# 以及 mSPRT 的混合方差、历史最小 p 值和置信区间交集。每次运行只读取 last_date 之后的每日统计量，
+# 逐日 O(1) 累加，不回扫历史明细。检验单位为每日统计量的单位（如 用户 × 日）。
+STATE_TABLE = "flow_ab_test.tbl_sequential_state"
+SUM_COLUMNS = ["n", "sum_x", "sum_x2", "sum_y", "sum_y2", "sum_xy"]
+STATE_COLUMNS = ["experiment_tag", "metric", "variation_id", "last_date"] + SUM_COLUMNS + \
+                ["tau2", "p_value", "ci_lower", "ci_upper", "updated_at"]
+
+# 需要等待成熟的指标：cohort 日期 + N 天后 dN 才确定，入账时间相应推后
+METRIC_LAG_DAYS = {f"retention_d{n}": n for n in RETENTION_DAYS}
+
+_table_ready = False
+
+
+def report_table_name(tag):
+    return f"tbl_report_sequential_{tag}"
+
+
+def _ensure_tables(conn, tag):
+    global _table_ready
+    if not _table_ready:
+        conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            experiment_tag VARCHAR(255) NOT NULL,
+            metric VARCHAR(128) NOT NULL,
+            variation_id VARCHAR(255) NOT NULL,
+            last_date DATE COMMENT '已入账的最后一天',
+            n DOUBLE,
+            sum_x DOUBLE,
+            sum_x2 DOUBLE,
+            sum_y DOUBLE,
+            sum_y2 DOUBLE,
+            sum_xy DOUBLE,
+            tau2 DOUBLE COMMENT 'mSPRT 混合方差，首次计算后固定',
+            p_value DOUBLE COMMENT '历史最小 p 值',
+            ci_lower DOUBLE,
+            ci_upper DOUBLE,
+            updated_at DATETIME
+        ) ENGINE=OLAP
+        PRIMARY KEY(experiment_tag, metric, variation_id)
+        DISTRIBUTED BY HASH(experiment_tag) BUCKETS 1
+        PROPERTIES ("replication_num" = "3");
+        """))
+        _table_ready = True
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS {report_table_name(tag)} (
+        metric VARCHAR(128),
+        variation_id VARCHAR(255),
+        through_date DATE,
+        n DOUBLE,
+        control_n DOUBLE,
+        control_estimate DOUBLE,
+        exp_estimate DOUBLE,
+        diff DOUBLE,
+        uplift DOUBLE,
+        always_valid_p DOUBLE,
+        ci_lower DOUBLE,
+        ci_upper DOUBLE,
+        is_significant TINYINT,
+        includes_unsettled TINYINT COMMENT '1 = 含仍可能被迟到数据修改的日期',
+        experiment_tag VARCHAR(255)
+    ) ENGINE=OLAP
+    DUPLICATE KEY(metric, variation_id)
+    DISTRIBUTED BY HASH(metric) BUCKETS 4
+    PROPERTIES ("replication_num" = "3");
+    """))
+
+
+def settled_until(metric, today=None):
+    """迟到数据窗口和成熟期之前的日期才入账；之后的日期只参与本次发布，不写入状态。"""
+    today = today or date.today()
+    return today - timedelta(days=LATE_ARRIVAL_DAYS + 1 + METRIC_LAG_DAYS.get(metric, 0))
+
+
+def _load_state(tag):
+    state = fetch_df(f"SELECT * FROM {STATE_TABLE} WHERE experiment_tag = '{tag}'")
+    state["variation_id"] = state["variation_id"].astype(str)
+    return state.set_index(["metric", "variation_id"])
+
+
+def _load_new_stats(tag):
+    """每个 (指标, 分组) 只读取状态 last_date 之后的每日统计量。"""
+    return fetch_df(f"""
+    SELECT s.event_date, s.metric, s.variation_id, {", ".join(f"s.{c}" for c in SUM_COLUMNS)}
+    FROM {stats_table_name(tag)} s
+    LEFT JOIN (
+        SELECT metric, variation_id, last_date
+        FROM {STATE_TABLE}
+        WHERE experiment_tag = '{tag}'
+    ) t ON s.metric = t.metric AND s.variation_id = t.variation_id
+    WHERE s.grain = 'daily'
+      AND (t.last_date IS NULL OR s.event_date > t.last_date)
+    """)
+
+
+def _accumulate(cumulative, rows):
+    """按 (metric, variation) 累加统计量；非比率指标的 Σy 等保持为空。"""
+    day_sums = rows.groupby(["metric", "variation_id"])[SUM_COLUMNS].sum(min_count=1)
+    sums = cumulative[SUM_COLUMNS].add(day_sums, fill_value=0) if not cumulative.empty else day_sums
+    return cumulative.drop(columns=SUM_COLUMNS).join(sums, how="outer") if not cumulative.empty \
+        else sums.assign(tau2=np.nan, p_value=np.nan, ci_lower=np.nan, ci_upper=np.nan)
+
+
+def _evaluate(cumulative, control):
+    """用累计统计量比较每个实验组与同指标的对照组，返回当前时刻的 mSPRT 结果（不含历史）。"""
+    m = moments(cumulative[SUM_COLUMNS].reset_index())
+    control_df = (m[m["variation_id"] == control][["metric", "n", "estimate", "se2"]]
+                  .rename(columns={"n": "control_n", "estimate": "control_estimate", "se2": "_c_se2"}))
+    pairs = m[m["variation_id"] != control].merge(control_df, on="metric", how="inner")
+    pairs = pairs.rename(columns={"estimate": "exp_estimate"}).set_index(["metric", "variation_id"])
+    pairs["diff"] = pairs["exp_estimate"] - pairs["control_estimate"]
+    pairs["variance"] = pairs["se2"] + pairs["_c_se2"]
+    return pairs
+
+
+def _fold(cumulative, evaluated):
+    """把当前结果并入状态的历史最小 p / 区间交集；tau2 首次出现时确定。"""
+    idx = evaluated.index
+    tau2 = cumulative.loc[idx, "tau2"]
+    tau2 = tau2.where(tau2.notna(), mixing_variance(evaluated["control_estimate"], evaluated["variance"]))
+    p_now = msprt_p_value(evaluated["diff"], evaluated["variance"], tau2)
+    lower_now, upper_now = msprt_interval(evaluated["diff"], evaluated["variance"], tau2)
+    p_value, ci_lower, ci_upper = running_update(cumulative.loc[idx, "p_value"], cumulative.loc[idx, "ci_lower"],
+                                                 cumulative.loc[idx, "ci_upper"], p_now, lower_now, upper_now)
+    return tau2, p_value, ci_lower, ci_upper
+
+
+def run_sequential(tag, control="0"):
+    """
+    1. 读取状态与 last_date 之后的每日统计量
+    2. 已稳定的日期逐日累加并更新 mSPRT 历史（写回状态表）
+    3. 尚未稳定的日期临时累加，只用于本次发布，不写入状态
+    4. 发布始终有效的 p 值和置信区间到 tbl_report_sequential_{tag}
+    """
+    if is_estimate_mode():
+        print("🔖 估算模式不更新序贯检验状态。")
+        return
+    engine = get_engine()
+    with engine.connect() as conn:
+        _ensure_tables(conn, tag)
+        if is_full_refresh():
+            conn.execute(text(f"DELETE FROM {STATE_TABLE} WHERE experiment_tag = '{tag}';"))
+            print(f"🔁 全量刷新：已清空 {tag} 的序贯检验状态")
+
+    state = _load_state(tag)
+    try:
+        new_stats = _load_new_stats(tag)
+    except Exception as e:
+        print(f"⚠️ 读取统计量失败（指标任务尚未写入？）：{e}")
+        return
+    new_stats["variation_id"] = new_stats["variation_id"].astype(str)
+    new_stats["event_date"] = new_stats["event_date"].map(as_date)
+    new_stats["settled"] = [d <= settled_until(m) for d, m in zip(new_stats["event_date"], new_stats["metric"])]
+
+    cumulative = state.drop(columns=["experiment_tag", "last_date", "updated_at"], errors="ignore")
+    last_dates = state["last_date"].map(as_date).to_dict() if not state.empty else {}
+
+    # 已稳定日期：逐日入账，每天的 p 值 / 区间并入历史
+    settled = new_stats[new_stats["settled"]]
+    for day, rows in settled.groupby("event_date", sort=True):
+        cumulative = _accumulate(cumulative, rows)
+        evaluated = _evaluate(cumulative, control)
+        if evaluated.empty:
+            continue
+        idx = evaluated.index
+        (cumulative.loc[idx, "tau2"], cumulative.loc[idx, "p_value"],
+         cumulative.loc[idx, "ci_lower"], cumulative.loc[idx, "ci_upper"]) = _fold(cumulative, evaluated)
+    if not cumulative.empty:
+        # last_date 只推进到实际入账的最后一天：没有新数据的 (指标, 分组) 保持不变，
+        # 之后补写的更早日期仍会被读到
+        folded_until = settled.groupby(["metric", "variation_id"])["event_date"].max().to_dict()
+        for key, day in folded_until.items():
+            last_dates[key] = max(last_dates.get(key) or date.min, day)
+        _save_state(tag, cumulative, last_dates)
+
+    # 未稳定日期：临时并入后发布，状态不变
+    unsettled = new_stats[~new_stats["settled"]]
+    published = _accumulate(cumulative, unsettled) if not unsettled.empty else cumulative
+    if published.empty:
+        print(f"⚠️ {tag} 没有可用于序贯检验的每日统计量")
+        return
+    # 发布截止日期：本次读到的最后一天，没有新数据的指标取已入账日期
+    through = {}
+    for (metric, _), last_date in last_dates.items():
+        through[metric] = max(last_date, through.get(metric, last_date))
+    through.update(new_stats.groupby("metric")["event_date"].max().to_dict())
+    _publish(tag, published, _evaluate(published, control), unsettled, through, control)
+
+
+def _save_state(tag, cumulative, last_dates):
+    frame = cumulative.reset_index()
+    frame["experiment_tag"] = tag
+    frame["last_date"] = [last_dates.get((m, v)) for m, v in zip(frame["metric"], frame["variation_id"])]
+    frame["updated_at"] = pd.Timestamp.now().floor("s")
+    # 主键表：Stream Load 按 (experiment_tag, metric, variation_id) 覆盖
+    stream_load(frame[STATE_COLUMNS], STATE_TABLE)
+    print(f"🧮 序贯检验状态已更新：{tag}，{len(frame)} 个 (指标, 分组)")
+
+
+def _publish(tag, published, evaluated, unsettled, through, control):
+    if evaluated.empty:
+        print(f"⚠️ {tag} 缺少对照组 {control} 的统计量，跳过发布")
+        return
+    tau2, p_value, ci_lower, ci_upper = _fold(published, evaluated)
+    report = evaluated.reset_index()
+    report["uplift"] = np.where(report["control_estimate"] != 0,
+                                report["diff"] / report["control_estimate"].where(report["control_estimate"] != 0, 1),
+                                0.0)
+    report["always_valid_p"] = np.asarray(p_value)
+    report["ci_lower"] = np.asarray(ci_lower)
+    report["ci_upper"] = np.asarray(ci_upper)
+    report["is_significant"] = (report["always_valid_p"] < MSPRT_ALPHA).astype(int)
+    unsettled_metrics = set(unsettled["metric"])
+    report["includes_unsettled"] = report["metric"].isin(unsettled_metrics).astype(int)
+    report["through_date"] = report["metric"].map(through)
+    report["experiment_tag"] = tag
+
+    columns = ["metric", "variation_id", "through_date", "n", "control_n", "control_estimate", "exp_estimate",
+               "diff", "uplift", "always_valid_p", "ci_lower", "ci_upper", "is_significant",
+               "includes_unsettled", "experiment_tag"]
+    table_name = report_table_name(tag)
+    with get_engine().connect() as conn:
+        conn.execute(text(f"TRUNCATE TABLE {table_name};"))
+    stream_load(report[columns], table_name)
+    print(f"📊 始终有效的序贯检验结果已写入 {table_name}：{int(report['is_significant'].sum())} 个显著")
+
+
+def main(tag):
+    run_sequential(tag)
+
+
+if __name__ == "__main__":
+    main("mobile_new")
@@ -0,0 +1,216 @@
+import base64
+import json
+import os
+import time
+import uuid
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+import requests
+
+from pipeline.db_engine import DB_HOST, DB_USER, DEFAULT_DATABASE
+
+# ============= Stream Load 配置 =============
+# DataFrame 通过 FE 的 HTTP 接口批量导入，不再生成由 FE 解析的多行 INSERT；写入已有表，不改表结构
+STREAM_LOAD_HOST = os.getenv("STREAM_LOAD_HOST", DB_HOST)
+STREAM_LOAD_PORT = int(os.getenv("STREAM_LOAD_PORT", "8030"))              # FE http_port
+STREAM_LOAD_BATCH_ROWS = int(os.getenv("STREAM_LOAD_BATCH_ROWS", "100000"))
+STREAM_LOAD_RETRIES = int(os.getenv("STREAM_LOAD_RETRIES", "3"))
+STREAM_LOAD_TIMEOUT = int(os.getenv("STREAM_LOAD_TIMEOUT", "600"))
+STREAM_LOAD_FORMATS = ("json", "csv")
+
+# 导入成功的状态；Publish Timeout 表示数据已提交、只是可见性稍后生效
+_OK_STATUSES = {"Success", "Publish Timeout"}
+
+
+def _split_table(table_name, database):
+    if "." in table_name:
+        return table_name.split(".", 1)
+    return database, table_name
+
+
+def _auth_header():
+    token = base64.b64encode(f"{DB_USER}:{os.environ['DB_PASSWORD']}".encode("utf-8")).decode("ascii")
+    return f"Basic {token}"
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def _prepare_frame(df):
+    """日期列转成字符串：纯日期输出 YYYY-MM-DD，带时间输出 YYYY-MM-DD HH:MM:SS；其余值保持原样。"""
+    df = df.copy()
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = series.dropna()
+            has_time = (values != values.dt.normalize()).any()
+            df[column] = series.dt.strftime("%Y-%m-%d %H:%M:%S" if has_time else "%Y-%m-%d")
+        elif series.dtype == object:
+            df[column] = series.map(_format_value)
+    return df
+
+
+def _encode_batch(batch, fmt):
+    if fmt == "json":
+        # NaN / None → null；force_ascii=False 保留中文列名和取值
+        return batch.to_json(orient="records", force_ascii=False).encode("utf-8")
+    return batch.to_csv(sep="\t", header=False, index=False, na_rep="\\N").encode("utf-8")
+
+
+def _headers(label, fmt, columns):
+    headers = {
+        "label": label,
+        "format": fmt,
+        "Expect": "100-continue",
+        "Authorization": _auth_header(),
+        "max_filter_ratio": "0",
+        "timeout": str(STREAM_LOAD_TIMEOUT),
+    }
+    if fmt == "json":
+        # JSON 按键名匹配列，不需要 columns 头（HTTP 头按 latin-1 编码，中文列名放不进去）
+        headers["strip_outer_array"] = "true"
+    else:
+        headers["column_separator"] = "\\t"
+        headers["columns"] = ", ".join(f"`{c}`" for c in columns)
+    return headers
+
+
+def _put(url, body, headers):
+    """
+    FE 会 307 重定向到某个 BE；requests 跨主机重定向时会丢掉 Authorization，
+    所以手动跟随一次重定向并重新带上鉴权头。
+    """
+    response = requests.put(url, data=body, headers=headers, allow_redirects=False, timeout=STREAM_LOAD_TIMEOUT)
+    if response.status_code in (301, 302, 307, 308) and response.headers.get("Location"):
+        response = requests.put(response.headers["Location"], data=body, headers=headers,
+                                allow_redirects=False, timeout=STREAM_LOAD_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def _load_batch(url, body, headers):
+    """
+    同一批次的所有重试使用同一个 label：上次其实已经成功（如响应丢失）时 StarRocks 返回
+    Label Already Exists，视为成功，不会重复写入。
+    """
+    last_error = None
+    for attempt in range(1, STREAM_LOAD_RETRIES + 1):
+        try:
+            result = _put(url, body, headers)
+        except (requests.RequestException, ValueError) as e:
+            last_error = e
+        else:
+            status = result.get("Status")
+            if status in _OK_STATUSES:
+                return result
+            if status == "Label Already Exists":
+                existing = result.get("ExistingJobStatus")
+                if existing == "FINISHED":
+                    print(f"♻️ Stream Load label {headers['label']} 已导入过，跳过。")
+                    return result
+                last_error = RuntimeError(f"label {headers['label']} 对应的导入仍在进行：{existing}")
+            else:
+                raise RuntimeError(f"Stream Load 失败：{status} {result.get('Message')} {result.get('ErrorURL') or ''}")
+        time.sleep(min(2 ** attempt, 30))
+    raise RuntimeError(f"Stream Load 重试 {STREAM_LOAD_RETRIES} 次仍失败：{last_error}")
+
+
+def stream_load(df, table_name, database=DEFAULT_DATABASE, label_prefix=None, fmt="json", batch_rows=None):
+    """
+    把 DataFrame 通过 Stream Load 写入已存在的表（建表 / 清空 / staging 由调用方负责，表结构不变）。
+    - 按 batch_rows 切批，每批一个 label：{label_prefix}_{序号}；未指定前缀时每次调用生成新的前缀，
+      批内重试复用 label，保证重试幂等；需要跨进程幂等时由调用方传入固定的 label_prefix
+    - fmt：json（默认，字符串含分隔符也安全）或 csv（制表符分隔，\\N 表示 NULL）
+    返回写入的行数。
+    """
+    if fmt not in STREAM_LOAD_FORMATS:
+        raise ValueError(f"未知格式 {fmt}，可选：{STREAM_LOAD_FORMATS}")
+    if df is None or df.empty:
+        print(f"⚠️ {table_name} 没有需要导入的数据。")
+        return 0
+
+    database, table = _split_table(table_name, database)
+    url = f"http://{STREAM_LOAD_HOST}:{STREAM_LOAD_PORT}/api/{database}/{table}/_stream_load"
+    label_prefix = label_prefix or f"{table}_{uuid.uuid4().hex[:12]}"
+    batch_rows = batch_rows or STREAM_LOAD_BATCH_ROWS
+
+    frame = _prepare_frame(df.replace([np.inf, -np.inf], np.nan))
+    columns = [str(c) for c in frame.columns]
+    if fmt == "csv" and not all(c.isascii() for c in columns):
+        raise ValueError(f"csv 格式需要通过 HTTP 头传列名，不支持非 ASCII 列名，请改用 json：{columns}")
+    loaded = 0
+    for index, start in enumerate(range(0, len(frame), batch_rows)):
+        batch = frame.iloc[start:start + batch_rows]
+        headers = _headers(f"{label_prefix}_{index}", fmt, columns)
+        result = _load_batch(url, _encode_batch(batch, fmt), headers)
+        loaded += int(result.get("NumberLoadedRows", len(batch)))
+    print(f"🚚 Stream Load 写入 {database}.{table} {loaded} 行（label 前缀 {label_prefix}）")
+    return loaded
+
+
+# ============= 本地 stub 服务自检：FE 重定向 / 重试复用 label / 重复 label 幂等 =============
+if __name__ == "__main__":
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    os.environ.setdefault("DB_PASSWORD", "stub")
+    stub_state = {"labels": {}, "fail_next": 1, "requests": 0}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            stub_state["requests"] += 1
+            if not self.path.startswith("/be"):
+                # 模拟 FE：重定向到 BE
+                self.send_response(307)
+                self.send_header("Location", f"http://127.0.0.1:{self.server.server_port}/be{self.path}")
+                self.end_headers()
+                return
+            assert self.headers.get("Authorization", "").startswith("Basic "), "重定向后缺少鉴权头"
+            if stub_state["fail_next"]:
+                stub_state["fail_next"] -= 1
+                self.send_response(500)
+                self.end_headers()
+                return
+            label = self.headers["label"]
+            rows = json.loads(body)
+            if label in stub_state["labels"]:
+                result = {"Status": "Label Already Exists", "ExistingJobStatus": "FINISHED"}
+            else:
+                stub_state["labels"][label] = rows
+                result = {"Status": "Success", "NumberLoadedRows": len(rows)}
+            payload = json.dumps(result).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    STREAM_LOAD_HOST, STREAM_LOAD_PORT = "127.0.0.1", server.server_port
+
+    frame = pd.DataFrame({
+        "dt": pd.to_datetime(["2025-01-01", "2025-01-02", "2025-01-03"]),
+        "variation": ["0", "1", "1"],
+        "留存率": [0.1, np.nan, 0.3],
+    })
+    assert stream_load(frame, "flow_ab_test.tbl_stub", label_prefix="stub_run", batch_rows=2) == 3
+    assert sorted(stub_state["labels"]) == ["stub_run_0", "stub_run_1"], stub_state["labels"]
+    assert stub_state["labels"]["stub_run_0"][0]["dt"] == "2025-01-01"
+    assert stub_state["labels"]["stub_run_0"][1]["留存率"] is None
+    assert "columns" not in _headers("stub_run_0", "json", list(frame.columns))
+    # 同一 label 再次导入：返回 Label Already Exists，视为成功且不重复写入
+    stream_load(frame, "flow_ab_test.tbl_stub", label_prefix="stub_run", batch_rows=2)
+    assert len(stub_state["labels"]) == 2
+    server.shutdown()
+    print(f"🧪 stub 自检通过：共 {stub_state['requests']} 次请求，label {sorted(stub_state['labels'])}")
@@ -0,0 +1,73 @@
+from sqlalchemy import text
+
+from pipeline.date_range import as_date
+
+# ============= 充分统计量输出约定 =============
+# 每个指标按 (event_date, variation_id) 输出用户级充分统计量：
+#   n = 用户数，sum_x / sum_x2 = 分子的 Σx / Σx²；比率指标另有分母的 Σy / Σy² 与 Σxy
+#   cuped 粒度的 sum_y / sum_y2 / sum_xy 为实验前协变量（同一指标的实验前取值）的矩
+# t 检验、置信区间、共轭后验都只需要这几列，不必把用户明细拉出 StarRocks。
+STATS_COLUMNS = ["event_date", "variation_id", "grain", "metric",
+                 "n", "sum_x", "sum_x2", "sum_y", "sum_y2", "sum_xy", "experiment_tag"]
+
+STATS_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    event_date DATE COMMENT '日期（overall 粒度为空）',
+    variation_id VARCHAR(255) COMMENT '实验分组',
+    grain VARCHAR(32) COMMENT 'daily / cohort / overall / cuped',
+    metric VARCHAR(128) COMMENT '指标名',
+    n BIGINT COMMENT '用户数',
+    sum_x DOUBLE COMMENT '分子 Σx',
+    sum_x2 DOUBLE COMMENT '分子 Σx²',
+    sum_y DOUBLE COMMENT '分母 Σy（非比率指标为空）',
+    sum_y2 DOUBLE COMMENT '分母 Σy²',
+    sum_xy DOUBLE COMMENT 'Σxy',
+    experiment_tag VARCHAR(255)
+) ENGINE=OLAP
+DUPLICATE KEY(event_date, variation_id)
+DISTRIBUTED BY HASH(variation_id) BUCKETS 4
+PROPERTIES ("replication_num" = "3");
+"""
+
+
+def stats_table_name(tag):
+    """同一标签下所有指标任务共用一张统计量表，按 metric 区分。"""
+    return f"tbl_report_metric_stats_{tag}"
+
+
+def prepare_stats(conn, tag, metric_names, refresh_start=None, grains=None):
+    """
+    建表并清掉本任务负责的指标的旧统计量：refresh_start 为空时删除这些指标的全部行，
+    否则只删除 refresh_start 及之后的日期（增量）。只按 metric（及 grains 指定的粒度）删除，
+    不影响其他任务并发写入的指标或同名指标的其他粒度。
+    """
+    table_name = stats_table_name(tag)
+    conn.execute(text(STATS_TABLE_DDL.format(table=table_name)))
+    names = ", ".join(f"'{name}'" for name in metric_names)
+    date_filter = f" AND event_date >= '{as_date(refresh_start)}'" if refresh_start else ""
+    grain_filter = f" AND grain IN ({', '.join(repr(g) for g in grains)})" if grains else ""
+    conn.execute(text(f"DELETE FROM {table_name} WHERE metric IN ({names}){date_filter}{grain_filter};"))
+    return table_name
+
+
+def stats_union_sql(metrics, experiment_tag, grain="daily", units="units"):
+    """
+    从用户级 CTE 生成统计量 SELECT（UNION ALL，每个指标一段）。
+    units：每个 (event_date, variation_id, 用户) 一行的 CTE 名；
+    metrics：[(指标名, x 列, y 列或 None, 计入 n 的条件)]。
+    """
+    unions = []
+    for name, x, y, present in metrics:
+        if y is None:
+            ratio_sql = "CAST(NULL AS DOUBLE) AS sum_y, CAST(NULL AS DOUBLE) AS sum_y2, CAST(NULL AS DOUBLE) AS sum_xy"
+        else:
+            ratio_sql = f"SUM({y}) AS sum_y, SUM({y} * {y}) AS sum_y2, SUM({x} * {y}) AS sum_xy"
+        unions.append(f"""
+    SELECT event_date, variation_id, '{grain}' AS grain, '{name}' AS metric,
+           SUM(CASE WHEN {present} THEN 1 ELSE 0 END) AS n,
+           SUM({x}) AS sum_x, SUM({x} * {x}) AS sum_x2,
+           {ratio_sql},
+           '{experiment_tag}' AS experiment_tag
+    FROM {units}
+    GROUP BY event_date, variation_id""")
+    return "\n    UNION ALL".join(unions)
@@ -0,0 +1,97 @@
+import os
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from pipeline.date_range import as_date
+from pipeline.db_engine import get_engine
+from pipeline.estimate import is_estimate_mode
+
+# ============= 增量刷新配置 =============
+WATERMARK_TABLE = "flow_ab_test.tbl_pipeline_watermark"
+LATE_ARRIVAL_DAYS = int(os.getenv("LATE_ARRIVAL_DAYS", "2"))   # 已算过的日期中，末尾需要重算的天数（迟到数据）
+RETENTION_MATURITY_DAYS = 15                                   # d15 留存 cohort 需要 15 天才完全成熟
+
+_full_refresh = os.getenv("FULL_REFRESH", "0") == "1"
+_table_ready = False
+
+
+def set_full_refresh(flag):
+    """main_run --full-refresh：本进程内所有指标忽略水位，按整个实验周期重算（用于回溯补数）。"""
+    global _full_refresh
+    _full_refresh = bool(flag)
+
+
+def is_full_refresh():
+    return _full_refresh
+
+
+def _ensure_table(conn):
+    global _table_ready
+    if _table_ready:
+        return
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+        tag VARCHAR(255) NOT NULL,
+        table_name VARCHAR(255) NOT NULL,
+        experiment_name VARCHAR(255) NOT NULL,
+        watermark_date DATE,
+        updated_at DATETIME
+    ) ENGINE=OLAP
+    PRIMARY KEY(tag, table_name, experiment_name)
+    DISTRIBUTED BY HASH(tag) BUCKETS 1
+    PROPERTIES ("replication_num" = "3");
+    """))
+    _table_ready = True
+
+
+def get_watermark(tag, table_name, experiment_name):
+    with get_engine().connect() as conn:
+        _ensure_table(conn)
+        row = conn.execute(text(f"""
+            SELECT watermark_date FROM {WATERMARK_TABLE}
+            WHERE tag = '{tag}' AND table_name = '{table_name}' AND experiment_name = '{experiment_name}'
+        """)).fetchone()
+    return as_date(row[0]) if row and row[0] else None
+
+
+def set_watermark(tag, table_name, experiment_name, watermark_date):
+    """写入本次已完成的最后日期（主键表，重复写入即覆盖）。只在指标表写入成功后调用。"""
+    if is_estimate_mode():
+        # 估算结果只是临时数字，不推进水位，下次精确运行会重算并覆盖
+        print(f"🔖 估算模式不更新水位：{table_name}")
+        return
+    with get_engine().connect() as conn:
+        _ensure_table(conn)
+        conn.execute(text(f"""
+            INSERT INTO {WATERMARK_TABLE} (tag, table_name, experiment_name, watermark_date, updated_at)
+            VALUES ('{tag}', '{table_name}', '{experiment_name}', '{as_date(watermark_date)}', NOW())
+        """))
+    print(f"🔖 水位已更新：{table_name} → {as_date(watermark_date)}")
+
+
+def plan_refresh(tag, table_name, experiment_name, first_day, last_day, trailing_days=None):
+    """
+    计算本次需要重算的起始日期，返回 (refresh_start, incremental)。
+    - 全量刷新 / 无水位 / 实验切换（按 experiment_name 区分水位）：从 first_day 开始，incremental=False
+    - 否则从 水位 + 1 - trailing_days 开始：新日期 + 末尾 trailing_days 天的迟到数据或未成熟 cohort
+    """
+    first_day, last_day = as_date(first_day), as_date(last_day)
+    if trailing_days is None:
+        trailing_days = LATE_ARRIVAL_DAYS
+    watermark = None if _full_refresh else get_watermark(tag, table_name, experiment_name)
+    if watermark is None or watermark < first_day:
+        print(f"🔁 {table_name} 全量计算：{first_day} ~ {last_day}")
+        return first_day, False
+
+    refresh_start = max(first_day, min(watermark + timedelta(days=1), last_day) - timedelta(days=trailing_days))
+    print(f"⏩ {table_name} 增量计算：{refresh_start} ~ {last_day}（水位 {watermark}，回看 {trailing_days} 天）")
+    return refresh_start, True
+
+
+def clear_refresh_range(conn, table_name, date_column, refresh_start, incremental):
+    """增量时只删除 refresh_start 及之后的日期，全量时清空整表。"""
+    if incremental:
+        conn.execute(text(f"DELETE FROM {table_name} WHERE {date_column} >= '{as_date(refresh_start)}';"))
+    else:
+        conn.execute(text(f"TRUNCATE TABLE {table_name};"))
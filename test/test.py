@@ -1,11 +1,14 @@
+import os
+
 import pandas as pd
 import numpy as np
 import statsmodels.api as sm
 import matplotlib.pyplot as plt
 from scipy.stats import ttest_ind, norm, mannwhitneyu
+from analysis.bootstrap import bootstrap_compare
 
-# 1. 读取数据
-df = pd.read_csv('AOV_user.csv')
+# 1. 读取数据（在仓库根目录运行 PYTHONPATH=. python test/test.py，以便导入 analysis）
+df = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'AOV_user.csv'))
 print("列名：", df.columns.tolist())
 print(df.head())
 
@@ -68,18 +71,14 @@ print(f'Bayesian uplift均值: {uplift_mean:.4f}')
 print(f'Bayesian uplift 95%置信区间: [{ci_low:.4f}, {ci_high:.4f}]')
 
 
-# 8. Bootstrap置信区间和概率
-boot_diffs = []
-for _ in range(10000):
-    a_sample = np.random.choice(a, size=len(a), replace=True)
-    b_sample = np.random.choice(b, size=len(b), replace=True)
-    boot_diffs.append(b_sample.mean() - a_sample.mean())
-boot_diffs = np.array(boot_diffs)
-ci_low, ci_high = np.percentile(boot_diffs, [2.5, 97.5])
-boot_prob = (boot_diffs > 0).mean()
+# 8. Bootstrap置信区间和概率（向量化 Poisson bootstrap，按内存上限分块）
+boot = bootstrap_compare(a, b, stat="mean", n_boot=10000, seed=0)
 print('\n【Bootstrap】')
-print(f'均值差95%置信区间: [{ci_low:.3f}, {ci_high:.3f}]')
-print(f'B>A的概率: {boot_prob:.3f}')
+print(f'均值差95%置信区间: [{boot["diff_ci_lower"]:.3f}, {boot["diff_ci_upper"]:.3f}]')
+print(f'B>A的概率: {boot["prob_b_gt_a"]:.3f}')
+boot_median = bootstrap_compare(a, b, stat="median", n_boot=2000, seed=0)
+print(f'中位数差95%置信区间: [{boot_median["diff_ci_lower"]:.3f}, {boot_median["diff_ci_upper"]:.3f}]')
+print(f'中位数 B>A的概率: {boot_median["prob_b_gt_a"]:.3f}')
 
 # 9. Mann-Whitney U 检验
 u_stat, u_p = mannwhitneyu(a, b, alternative='two-sided')